@@ -0,0 +1,88 @@
+"""
+Benchmark the uc480 acquisition pipelines against the simulated camera and shutter.
+
+Every combination of capture mode and output format records one short run through
+ExperimentRunner, exactly as AquisitionProgram does, and the achieved frame rate,
+dropped frames, gaps in the frame sequence, frame interval jitter and shutter
+scheduling error are reported.
+
+    python AcquisitionBenchmark.py --fps 10 30 60 --width 1280 --height 1024
+    python AcquisitionBenchmark.py --fps 60 120 --roi 400 300 480 200
+"""
+import argparse
+import functools
+import os
+import tempfile
+
+import numpy as np
+
+from CameraSession import CameraSession
+from ExperimentRunner import ExperimentRunner
+from ShutterController import ShutterController
+from SimulatedDevices import SimulatedLaser, SimulatedSerial, SimulatedUC480Camera
+
+CAPTURE_MODES = ['Stream to disk', 'RAM buffer']
+OUTPUT_FORMATS = ['AVI (MJPG)', 'Raw (lossless)']
+
+
+def benchmark_configuration(directory, fps, resolution, capture_mode, output_format, phase_times, roi=None,
+                            cameras=1, verbose=False):
+    laser = SimulatedLaser()
+    sessions = [CameraSession(100, fps, camera_factory=lambda: SimulatedUC480Camera(resolution, max_fps=fps, laser=laser),
+                              roi=roi, cam_id=k) for k in range(cameras)]
+    shutter = ShutterController('SIM', serial_class=functools.partial(SimulatedSerial, laser=laser))
+    log = (lambda message, tag=None: print(message)) if verbose else (lambda message, tag=None: None)
+    runner = ExperimentRunner(sessions, shutter, log=log)
+
+    file_name = os.path.join(directory, f"bench_{int(fps)}fps_{capture_mode[:3]}_{output_format[:3]}")
+    result = runner.run_experiment(file_name, 1, *phase_times, fps, capture_mode=capture_mode,
+                                   output_format=output_format)[0]
+
+    # Statistics of the first camera
+    camera_name = runner.camera_file_names(file_name)[0]
+    timestamps = np.loadtxt(camera_name + '_timestamps_run0.csv', delimiter=',', skiprows=1, ndmin=2)[:, 1]
+    intervals = np.diff(timestamps)
+    gaps = np.loadtxt(camera_name + '_metrics_run0.csv', delimiter=',', skiprows=1, usecols=3, ndmin=1)
+    return {
+        'achieved_fps': 1.0 / np.mean(intervals) if len(intervals) else 0.0,
+        'frames_dropped': result['frames_dropped'],
+        'gaps': int(np.sum(gaps)),
+        'interval_jitter': np.std(intervals) if len(intervals) else float('nan'),
+        'max_scheduling_error': max(abs(error) for error in result['scheduling_errors'].values()),
+        'mean_toggle_latency': np.mean(result['toggle_latencies']),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark acquisition pipelines with simulated hardware.")
+    parser.add_argument('--fps', type=float, nargs='+', default=[10.0, 30.0, 60.0], help="frame rates to test")
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=1024)
+    parser.add_argument('--roi', type=int, nargs=4, default=None, metavar=('X', 'Y', 'WIDTH', 'HEIGHT'),
+                        help="area of interest to record instead of the full sensor")
+    parser.add_argument('--cameras', type=int, default=1, help="number of simulated cameras recording together")
+    parser.add_argument('--phases', type=float, nargs=3, default=[1.0, 2.0, 1.0],
+                        metavar=('BACKGROUND', 'LASER', 'RECOVERY'), help="phase durations in seconds")
+    parser.add_argument('--output', default=None, help="keep the recorded files in this directory")
+    parser.add_argument('--verbose', action='store_true', help="print the experiment log")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        directory = args.output if args.output else temp_directory
+        os.makedirs(directory, exist_ok=True)
+
+        print(f"{'fps':>6} {'capture mode':<15} {'output':<15} {'achieved':>9} {'dropped':>8} {'gaps':>5} "
+              f"{'jitter ms':>10} {'sched ms':>9} {'toggle ms':>10}")
+        for fps in args.fps:
+            for capture_mode in CAPTURE_MODES:
+                for output_format in OUTPUT_FORMATS:
+                    stats = benchmark_configuration(directory, fps, (args.width, args.height), capture_mode,
+                                                    output_format, args.phases, roi=args.roi,
+                                                    cameras=args.cameras, verbose=args.verbose)
+                    print(f"{fps:>6.1f} {capture_mode:<15} {output_format:<15} {stats['achieved_fps']:>9.2f} "
+                          f"{stats['frames_dropped']:>8d} {stats['gaps']:>5d} {stats['interval_jitter'] * 1000:>10.2f} "
+                          f"{stats['max_scheduling_error'] * 1000:>9.2f} {stats['mean_toggle_latency'] * 1000:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+import csv
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+class VideoFileWriter:
+    """Encode frames into an AVI file and remember the timestamp of every written frame."""
+
+    def __init__(self, file_name, fps, frame_size, fourcc='MJPG', is_color=False):
+        self.file_name = file_name
+        self.out = cv2.VideoWriter(file_name, cv2.VideoWriter_fourcc(*fourcc), fps, frame_size, isColor=is_color)
+        self.timestamps = []
+
+    def write(self, frame, timestamp):
+        self.out.write(frame)
+        self.timestamps.append(timestamp)
+
+    @property
+    def bytes_written(self):
+        # The encoder writes straight to the file, so its size is what has been written so far
+        return os.path.getsize(self.file_name) if os.path.exists(self.file_name) else 0
+
+    def close(self):
+        self.out.release()
+
+
+class AcquisitionPipeline:
+    """
+    Producer/consumer acquisition: one capture thread, one writer thread per writer.
+
+    The capture thread only grabs frames and pushes (frame, timestamp) onto a bounded
+    queue for every writer, so encoder latency never holds up the camera. If a writer
+    falls behind and its queue is full, the frame is dropped for that writer and counted.
+    If a writer raises, e.g. when the disk is full, its thread goes on emptying the queue
+    so stop() can't block, and stop() raises the error once everything has been closed.
+
+    :param grab_frame: callable returning the next frame from the camera
+    :param writers: objects with write(frame, timestamp) and close() methods
+    :param queue_size: maximum number of frames buffered per writer
+    :param telemetry: optional AcquisitionTelemetry fed with captures and with the writes of the first writer
+    :param frame_time: callable returning the time in seconds of the frame just grabbed, e.g. from the camera's
+                       own timestamps; by default frames are timed by their arrival from time.perf_counter()
+    """
+
+    def __init__(self, grab_frame, writers, queue_size=64, telemetry=None, frame_time=None):
+        self.grab_frame = grab_frame
+        self.frame_time = frame_time if frame_time is not None else time.perf_counter
+        self.writers = list(writers)
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in self.writers]
+        self.queue_size = queue_size
+        self.telemetry = telemetry
+
+        self.start_time = None
+        self.frames_captured = 0
+        self.frames_dropped = [0] * len(self.writers)
+        self.max_queue_depth = [0] * len(self.writers)
+
+        self.errors = []
+        self._stop_event = threading.Event()
+        self._capture_thread = None
+        self._writer_threads = []
+
+    def start(self, start_time=None):
+        # Timestamps are taken from frame_time relative to start_time
+        self.start_time = self.frame_time() if start_time is None else start_time
+        self.errors = []
+        self._stop_event.clear()
+
+        for i, (writer, frame_queue) in enumerate(zip(self.writers, self.queues)):
+            telemetry = self.telemetry if i == 0 else None
+            thread = threading.Thread(target=self._write_loop, args=(writer, frame_queue, telemetry), daemon=True)
+            thread.start()
+            self._writer_threads.append(thread)
+
+        self._capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self._capture_thread.start()
+
+    def stop(self):
+        # Stop capturing first, then let the writers drain whatever is still queued
+        self._stop_event.set()
+        if self._capture_thread is not None:
+            self._capture_thread.join()
+
+        for frame_queue in self.queues:
+            frame_queue.put(None)
+        for thread in self._writer_threads:
+            thread.join()
+        self._writer_threads = []
+
+        for writer in self.writers:
+            writer.close()
+        if self.errors:
+            raise self.errors[0]
+
+    def _capture_loop(self):
+        while not self._stop_event.is_set():
+            frame = self.grab_frame()
+            if frame is None:
+                continue
+            timestamp = self.frame_time() - self.start_time
+            self.frames_captured += 1
+            if self.telemetry is not None:
+                self.telemetry.record_capture(timestamp)
+
+            for i, frame_queue in enumerate(self.queues):
+                try:
+                    frame_queue.put_nowait((frame, timestamp))
+                except queue.Full:
+                    self.frames_dropped[i] += 1
+                    continue
+                depth = frame_queue.qsize()
+                if depth > self.max_queue_depth[i]:
+                    self.max_queue_depth[i] = depth
+
+    def _write_loop(self, writer, frame_queue, telemetry=None):
+        failed = False
+        while True:
+            item = frame_queue.get()
+            if item is None:
+                break
+            if failed:
+                continue  # Keep the queue empty until stop() sends the sentinel
+            try:
+                if telemetry is None:
+                    writer.write(*item)
+                    continue
+                write_start = time.perf_counter()
+                writer.write(*item)
+                telemetry.record_write(item[1], time.perf_counter() - write_start,
+                                       getattr(writer, 'bytes_written', 0), frame_queue.qsize())
+            except Exception as e:
+                self.errors.append(e)
+                failed = True
+
+    def report(self):
+        lines = [f"Captured {self.frames_captured} frames"]
+        for i in range(len(self.writers)):
+            lines.append(f"Writer {i + 1}: max queue depth {self.max_queue_depth[i]}/{self.queue_size}, "
+                         f"dropped {self.frames_dropped[i]} frames")
+        return "\n".join(lines)
+
+
+class RingBufferCapture:
+    """
+    Capture a run into a pre-allocated in-memory ring buffer and write it to disk afterwards.
+
+    The buffer is allocated and touched once, so during the run each frame is only copied
+    into the next slot and nothing is allocated or written to disk. If a run delivers more
+    frames than the buffer holds, the oldest frames are overwritten and counted as dropped.
+    The same buffer can be reused for every run of an experiment. Monitors, objects with
+    write(frame, timestamp) and close() like a writer, are fed on their own threads while
+    the run records; a monitor that falls behind simply misses frames, and the error of a
+    monitor that raises is raised by stop().
+
+    :param grab_frame: callable returning the next frame from the camera
+    :param frame_shape: (height, width) of the camera frames
+    :param capacity: number of frames the buffer holds
+    :param telemetry: optional AcquisitionTelemetry fed with captures and, during flush(), with writes
+    :param monitors: objects looking at the frames during the run, e.g. a SignalMonitor
+    """
+
+    def __init__(self, grab_frame, frame_shape, capacity, dtype=np.uint8, telemetry=None, monitors=(),
+                 monitor_queue_size=16):
+        self.grab_frame = grab_frame
+        self.capacity = capacity
+        self.telemetry = telemetry
+        self.monitors = list(monitors)
+        self.monitor_queue_size = monitor_queue_size
+        # Fill the buffers so the pages are committed before the run starts
+        self.frames = np.empty((capacity,) + tuple(frame_shape), dtype=dtype)
+        self.frames.fill(0)
+        self.timestamps = np.zeros(capacity)
+
+        self.start_time = None
+        self.frames_captured = 0
+        self.errors = []
+        self._stop_event = threading.Event()
+        self._capture_thread = None
+        self._monitor_queues = []
+        self._monitor_threads = []
+
+    @property
+    def frames_dropped(self):
+        return max(0, self.frames_captured - self.capacity)
+
+    def start(self, start_time=None):
+        self.start_time = time.perf_counter() if start_time is None else start_time
+        self.frames_captured = 0
+        self.errors = []
+        self._stop_event.clear()
+
+        self._monitor_queues = [queue.Queue(maxsize=self.monitor_queue_size) for _ in self.monitors]
+        self._monitor_threads = []
+        for monitor, frame_queue in zip(self.monitors, self._monitor_queues):
+            thread = threading.Thread(target=self._monitor_loop, args=(monitor, frame_queue), daemon=True)
+            thread.start()
+            self._monitor_threads.append(thread)
+
+        self._capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self._capture_thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._capture_thread is not None:
+            self._capture_thread.join()
+            self._capture_thread = None
+
+        for frame_queue in self._monitor_queues:
+            frame_queue.put(None)
+        for thread in self._monitor_threads:
+            thread.join()
+        for monitor in self.monitors:
+            monitor.close()
+        self._monitor_threads = []
+        if self.errors:
+            raise self.errors[0]
+
+    def _capture_loop(self):
+        while not self._stop_event.is_set():
+            frame = self.grab_frame()
+            if frame is None:
+                continue
+            index = self.frames_captured % self.capacity
+            self.frames[index] = frame
+            self.timestamps[index] = time.perf_counter() - self.start_time
+            self.frames_captured += 1
+            if self.telemetry is not None:
+                self.telemetry.record_capture(self.timestamps[index])
+
+            for frame_queue in self._monitor_queues:
+                try:
+                    frame_queue.put_nowait((frame, self.timestamps[index]))
+                except queue.Full:
+                    pass
+
+    def _monitor_loop(self, monitor, frame_queue):
+        failed = False
+        while True:
+            item = frame_queue.get()
+            if item is None:
+                break
+            if failed:
+                continue  # Keep the queue empty until stop() sends the sentinel
+            try:
+                monitor.write(*item)
+            except Exception as e:
+                self.errors.append(e)
+                failed = True
+
+    def flush(self, writer):
+        # Write the buffered frames to the writer in the order they were captured
+        count = min(self.frames_captured, self.capacity)
+        first = self.frames_captured - count
+        for i in range(first, self.frames_captured):
+            index = i % self.capacity
+            write_start = time.perf_counter()
+            writer.write(self.frames[index], self.timestamps[index])
+            if self.telemetry is not None:
+                # The queue depth of a buffered run is the number of frames still waiting in the buffer
+                self.telemetry.record_write(self.timestamps[index], time.perf_counter() - write_start,
+                                            getattr(writer, 'bytes_written', 0), self.frames_captured - i - 1)
+        writer.close()
+
+    def report(self):
+        return (f"Captured {self.frames_captured} frames into a {self.capacity} frame buffer, "
+                f"dropped {self.frames_dropped} frames")
+
+
+def write_timestamps(file_name, timestamps):
+    with open(file_name, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['frame', 'timestamp'])
+        for i, timestamp in enumerate(timestamps):
+            writer.writerow([i, timestamp])
@@ -0,0 +1,110 @@
+import os
+import shutil
+import time
+
+import numpy as np
+
+from ExperimentLog import print_log
+from RawFrameContainer import DATA_OFFSET
+
+# Typical size of a greyscale thermal lens frame after MJPG compression, in bytes per pixel
+MJPG_BYTES_PER_PIXEL = 0.15
+
+# Required write speed and disk space relative to the estimate, for file system overhead and safety
+SAFETY_FACTOR = 1.5
+
+
+def estimate_run_bytes(frame_shape, fps, duration, output_format, dtype=np.uint8, chunk_frames=32):
+    """
+    Estimate the size of the video file of one run.
+
+    :param frame_shape: (height, width) of the frames
+    :param fps: frame rate
+    :param duration: length of the run in seconds
+    :param output_format: 'AVI (MJPG)' or 'Raw (lossless)'
+    """
+    frames = int(np.ceil(fps * duration))
+    pixels = frame_shape[0] * frame_shape[1]
+    if output_format == 'Raw (lossless)':
+        # Whole chunks are written, plus the header and about 20 bytes of metadata per frame
+        chunks = int(np.ceil(frames / chunk_frames))
+        return DATA_OFFSET + chunks * chunk_frames * pixels * np.dtype(dtype).itemsize + 20 * frames
+    return int(frames * pixels * MJPG_BYTES_PER_PIXEL)
+
+
+def measure_write_speed(directory, size=64 * 2 ** 20, block_size=4 * 2 ** 20):
+    """Return the sustained write speed of directory in bytes per second, measured with a short test file."""
+    test_file = os.path.join(directory, '.write_speed_test')
+    block = np.random.default_rng().integers(0, 256, block_size, dtype=np.uint8).tobytes()
+    start = time.perf_counter()
+    try:
+        with open(test_file, 'wb') as f:
+            for _ in range(size // block_size):
+                f.write(block)
+            f.flush()
+            os.fsync(f.fileno())  # Time the disk, not the page cache
+        elapsed = time.perf_counter() - start
+    finally:
+        if os.path.exists(test_file):
+            os.remove(test_file)
+    return size / elapsed
+
+
+def run_preflight(file_name, frame_shape, fps, run_time, num_runs, output_format, cameras=1, log=print_log):
+    """
+    Check that the disk can hold and keep up with an experiment before it starts.
+
+    The size of every run is estimated from the frame size, frame rate, format and run
+    length, and the write speed of the target directory is measured. If the raw format
+    doesn't fit but MJPG does, MJPG is chosen instead.
+
+    :param file_name: base file name of the experiment, its directory is checked
+    :param run_time: length of one run in seconds
+    :param cameras: number of cameras recording at the same time
+    :return: dict with ok, the output_format to use, the estimates and the measurements
+    """
+    directory = os.path.dirname(os.path.abspath(file_name))
+    free_bytes = shutil.disk_usage(directory).free
+    write_speed = measure_write_speed(directory)
+    log(f"Disk: {free_bytes / 1e9:.1f} GB free, writes {write_speed / 1e6:.0f} MB/s")
+
+    formats = [output_format] + (['AVI (MJPG)'] if output_format == 'Raw (lossless)' else [])
+    problems = []
+    for candidate in formats:
+        run_bytes = cameras * estimate_run_bytes(frame_shape, fps, run_time, candidate)
+        total_bytes = num_runs * run_bytes
+        required_speed = SAFETY_FACTOR * run_bytes / run_time
+        fits = SAFETY_FACTOR * total_bytes < free_bytes
+        fast_enough = required_speed < write_speed
+        log(f"{candidate}: {run_bytes / 1e6:.0f} MB per run, {total_bytes / 1e9:.2f} GB in total, "
+            f"needs {required_speed / 1e6:.0f} MB/s")
+        if fits and fast_enough:
+            if candidate != output_format:
+                log(f"Recording as {candidate} instead of {output_format}, which the disk can't keep up with or hold",
+                    "red")
+            return {
+                'ok': True,
+                'output_format': candidate,
+                'run_bytes': run_bytes,
+                'total_bytes': total_bytes,
+                'free_bytes': free_bytes,
+                'write_speed': write_speed,
+                'required_speed': required_speed,
+            }
+        reasons = []
+        if not fits:
+            reasons.append("not enough free disk space")
+        if not fast_enough:
+            reasons.append("the disk is too slow")
+        problems.append(f"{' and '.join(reasons)} for {candidate}")
+
+    log(f"Experiment not started: {'; '.join(problems)}", "red")
+    return {
+        'ok': False,
+        'output_format': output_format,
+        'run_bytes': run_bytes,
+        'total_bytes': total_bytes,
+        'free_bytes': free_bytes,
+        'write_speed': write_speed,
+        'required_speed': required_speed,
+    }
@@ -0,0 +1,111 @@
+import bisect
+import csv
+import threading
+
+import numpy as np
+
+
+class AcquisitionTelemetry:
+    """
+    Live performance figures of one acquisition run.
+
+    The capture thread calls record_capture() for every frame and the writer thread
+    calls record_write() for every frame it encodes; status() and summary() can be
+    called from any thread while the run is going. A gap is an inter-frame interval
+    longer than gap_factor nominal frame periods, i.e. frames the camera never delivered.
+
+    :param fps: nominal frame rate of the run
+    :param gap_factor: interval, in frame periods, above which a gap is counted
+    """
+
+    # Histogram bin edges in units of the nominal frame period
+    INTERVAL_BINS = [0.0, 0.5, 0.9, 1.1, 1.5, 2.5, np.inf]
+
+    def __init__(self, fps, gap_factor=1.5):
+        self.frame_period = 1.0 / fps
+        self.gap_factor = gap_factor
+        self.capture_times = []
+        self.writes = {}  # capture timestamp -> (encode time, total bytes written, queue depth)
+        self._lock = threading.Lock()
+
+    def record_capture(self, timestamp):
+        with self._lock:
+            self.capture_times.append(timestamp)
+
+    def record_write(self, timestamp, encode_time, bytes_written, queue_depth):
+        with self._lock:
+            self.writes[timestamp] = (encode_time, bytes_written, queue_depth)
+
+    def _intervals(self, capture_times):
+        return np.diff(capture_times) if len(capture_times) > 1 else np.zeros(0)
+
+    def gaps(self, intervals):
+        return int(np.sum(intervals > self.gap_factor * self.frame_period))
+
+    def interval_histogram(self, intervals):
+        counts, _ = np.histogram(intervals / self.frame_period, bins=self.INTERVAL_BINS)
+        return counts
+
+    def status(self, window=1.0):
+        """Return a one-line status covering the last window seconds of the run."""
+        with self._lock:
+            capture_times = list(self.capture_times)
+            writes = list(self.writes.values())
+        if len(capture_times) < 2:
+            return "Waiting for frames..."
+
+        first = bisect.bisect_left(capture_times, capture_times[-1] - window)
+        recent = capture_times[first:]
+        fps = (len(recent) - 1) / (recent[-1] - recent[0]) if len(recent) > 1 and recent[-1] > recent[0] else 0.0
+
+        gaps = self.gaps(self._intervals(capture_times))
+        if not writes:
+            # Buffered runs are only written after the run
+            return f"{fps:.1f} fps, {len(capture_times)} frames buffered, {gaps} gaps"
+
+        recent_writes = writes[-len(recent):]
+        encode_ms = 1000 * np.mean([write[0] for write in recent_writes])
+        queue_depth = recent_writes[-1][2]
+        bytes_per_second = 0.0
+        if len(recent_writes) > 1 and recent[-1] > recent[0]:
+            bytes_per_second = (recent_writes[-1][1] - recent_writes[0][1]) / (recent[-1] - recent[0])
+
+        return (f"{fps:.1f} fps, queue {queue_depth}, encode {encode_ms:.1f} ms/frame, "
+                f"{bytes_per_second / 1e6:.1f} MB/s, {gaps} gaps")
+
+    def summary(self):
+        with self._lock:
+            capture_times = list(self.capture_times)
+            writes = list(self.writes.values())
+        intervals = self._intervals(capture_times)
+        duration = capture_times[-1] - capture_times[0] if len(capture_times) > 1 else 0.0
+        fps = (len(capture_times) - 1) / duration if duration > 0 else 0.0
+        histogram = self.interval_histogram(intervals)
+        labels = ["<0.5", "0.5-0.9", "0.9-1.1", "1.1-1.5", "1.5-2.5", ">2.5"]
+        lines = [f"Achieved {fps:.2f} fps over {len(capture_times)} frames, {self.gaps(intervals)} gaps",
+                 "Frame intervals (periods): " + ", ".join(f"{label}: {count}" for label, count in zip(labels, histogram))]
+        if writes:
+            lines.append(f"Encode {1000 * np.mean([write[0] for write in writes]):.2f} ms/frame, "
+                         f"max queue depth {max(write[2] for write in writes)}, "
+                         f"{max(write[1] for write in writes) / 1e6:.1f} MB written")
+        return "\n".join(lines)
+
+    def write_csv(self, file_name):
+        # One row per captured frame; frames dropped before the writer have no write figures
+        with self._lock:
+            capture_times = list(self.capture_times)
+            writes = dict(self.writes)
+        with open(file_name, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['frame', 'timestamp', 'interval', 'gap', 'written', 'encode_time', 'bytes_written',
+                             'queue_depth'])
+            previous = None
+            for i, timestamp in enumerate(capture_times):
+                interval = timestamp - previous if previous is not None else ''
+                gap = int(previous is not None and interval > self.gap_factor * self.frame_period)
+                write = writes.get(timestamp)
+                if write is not None:
+                    writer.writerow([i, timestamp, interval, gap, 1, write[0], write[1], write[2]])
+                else:
+                    writer.writerow([i, timestamp, interval, gap, 0, '', '', ''])
+                previous = timestamp
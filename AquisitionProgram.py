@@ -4,17 +4,47 @@ import cv2
 from pylablib.devices import uc480
 import serial
 import serial.tools.list_ports
-import time
-import csv
+import sys
+import functools
+from ShutterController import ShutterController
+from CameraSession import CameraSession
+from LiveView import LiveView
+from ExperimentRunner import ExperimentRunner
+from ExperimentLog import ExperimentLog
+from ExperimentWorker import ExperimentWorker
+from AcquisitionPreflight import run_preflight
+from ShutterCalibration import calibrate_shutter, load_calibration, save_calibration
+from SimulatedDevices import SimulatedLaser, SimulatedSerial, SimulatedUC480Camera
 
 class MainApp(tk.Tk):
-    def __init__(self):
+    def __init__(self, simulate=False):
         super().__init__()
         self.title("Thermal Lensing Experiment")
 
+        # With simulate=True a synthetic camera and shutter replace the hardware
+        self.simulate = simulate
+        if simulate:
+            self.title("Thermal Lensing Experiment (simulated hardware)")
+            self.laser = SimulatedLaser()
+            self.camera_factory = lambda: SimulatedUC480Camera(laser=self.laser)
+            self.serial_class = functools.partial(SimulatedSerial, laser=self.laser)
+        else:
+            self.camera_factory = None
+            self.serial_class = serial.Serial
+
         # get available COM ports
         com_ports = self.get_com_ports()
 
+        # The shutter port is opened on first use and kept open for the session
+        self.shutter = None
+
+        # Live view state, see live_camera
+        self.live_view = None
+        self.roi_anchor = None
+
+        # Experiments and calibrations run on a worker thread that only logs to this queue
+        self.experiment_log = ExperimentLog()
+
 
         # Use a single frame to contain three frames
         parameters_frame = tk.Frame(self)
@@ -31,7 +61,7 @@ class MainApp(tk.Tk):
 
         # COM Port Selection
         self.com_port = tk.StringVar(self)
-        self.com_port.set('COM3')  # default value
+        self.com_port.set('SIM' if simulate else 'COM3')  # default value
 
         # COM Port Frame
         com_port_frame = tk.LabelFrame(parameters_frame, text="Select COM port")
@@ -65,6 +95,11 @@ class MainApp(tk.Tk):
         tk.Label(setup_frame, text="System Recovery Time").grid(row=3, column=0)
         tk.Entry(setup_frame, textvariable=self.recovery_time_var).grid(row=3, column=1)
 
+        # Runs with a lower live signal are recorded again, empty keeps every run
+        self.min_signal_var = tk.StringVar(value='')
+        tk.Label(setup_frame, text="Minimum Signal").grid(row=4, column=0)
+        tk.Entry(setup_frame, textvariable=self.min_signal_var).grid(row=4, column=1)
+
         # Camera Parameters Frame
         #camera_frame = tk.LabelFrame(root, text="Camera Parameters")
         #camera_frame.pack(fill="both", expand="yes", padx=10, pady=10)
@@ -79,6 +114,31 @@ class MainApp(tk.Tk):
         tk.Label(camera_frame, text="Exposure Time").grid(row=1, column=0)
         tk.Entry(camera_frame, textvariable=self.exposure_time_var).grid(row=1, column=1)
 
+        # Capture Mode
+        self.capture_mode_var = tk.StringVar(value='Stream to disk')
+        tk.Label(camera_frame, text="Capture Mode").grid(row=3, column=0)
+        tk.OptionMenu(camera_frame, self.capture_mode_var, 'Stream to disk', 'RAM buffer').grid(row=3, column=1, sticky='w')
+
+        # Output Format
+        self.output_format_var = tk.StringVar(value='AVI (MJPG)')
+        tk.Label(camera_frame, text="Output Format").grid(row=4, column=0)
+        tk.OptionMenu(camera_frame, self.output_format_var, 'AVI (MJPG)', 'Raw (lossless)').grid(row=4, column=1, sticky='w')
+
+        # Camera IDs, several cameras record the same runs from different viewpoints
+        self.cameras_var = tk.StringVar(value='0')
+        tk.Label(camera_frame, text="Cameras").grid(row=6, column=0)
+        tk.Entry(camera_frame, textvariable=self.cameras_var).grid(row=6, column=1)
+
+        # Area of interest, drawn in the live view or typed in; empty records the full sensor
+        self.roi_var = tk.StringVar(value='')
+        tk.Label(camera_frame, text="ROI (x, y, width, height)").grid(row=5, column=0)
+        tk.Entry(camera_frame, textvariable=self.roi_var).grid(row=5, column=1)
+
+        # Camera Session Mode
+        self.keep_camera_open_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(camera_frame, text="Keep camera open between runs",
+                       variable=self.keep_camera_open_var).grid(row=2, column=0, columnspan=2, sticky='w')
+
         # Experiment Information Frame
         info_frame = tk.LabelFrame(self, text="Experiment Information")
         info_frame.pack(fill="both", expand="yes", padx=10, pady=10)
@@ -113,13 +173,24 @@ class MainApp(tk.Tk):
         self.live_camera_button = tk.Button(self, text="Live Camera", command=self.live_camera)
         self.live_camera_button.pack(fill="x", padx=10, pady=5)
 
+        self.calibrate_shutter_button = tk.Button(self, text="Calibrate Shutter", command=self.calibrate_shutter)
+        self.calibrate_shutter_button.pack(fill="x", padx=10, pady=5)
+
         self.run_experiment_button=tk.Button(self, text="Run Experiment",command=self.run_experiment)
         self.run_experiment_button.pack(fill="x", padx=10, pady=5)
 
         tk.Button(self, text="Open Video Viewer", command=self.video_viewer).pack(fill="x", padx=10, pady=5)
-        tk.Button(self, text="Quit", command=self.quit).pack(fill="x", padx=10, pady=5)
+        tk.Button(self, text="Quit", command=self.on_closing).pack(fill="x", padx=10, pady=5)
+        self.protocol("WM_DELETE_WINDOW", self.on_closing)
+
+        # The shutter is a toggle, so it must not be clicked while a run or calibration uses it
+        self.worker = ExperimentWorker(self, self.console_text, self.experiment_log,
+                                       (self.run_experiment_button, self.calibrate_shutter_button,
+                                        self.live_camera_button, self.toggle_shutter_button))
 
     def get_com_ports(self):
+        if self.simulate:
+            return ['SIM']
         ports = serial.tools.list_ports.comports()
         return [port.device for port in ports]
 
@@ -131,162 +202,195 @@ class MainApp(tk.Tk):
             self.cap = cv2.VideoCapture(file_path)
 
 
-    def toggle_shutter(self):
+    def get_shutter(self):
+        # Reuse the open connection unless a different COM port has been selected
+        if self.shutter is None or self.shutter.port != self.com_port.get():
+            if self.shutter is not None:
+                self.shutter.close()
+            self.shutter = ShutterController(self.com_port.get(), serial_class=self.serial_class)
+        return self.shutter
 
-        ser = serial.Serial(port=self.com_port.get(), baudrate=10000, bytesize=8, timeout=2, stopbits=serial.STOPBITS_ONE)
-        ser.write(b'\xFF')
-        self.console_text.insert(tk.END, "Shutter toggled\n")
-        self.update()
+    def toggle_shutter(self):
+        toggle_time, latency = self.get_shutter().toggle()
+        self.update_console(f"Shutter toggled ({latency * 1000:.2f} ms)")
+        return toggle_time, latency
+
+    def calibrate_shutter(self):
+        # The camera has to look at the laser spot or a photodiode with the shutter closed
+        if self.live_view is not None:
+            self.close_live_view()
+        session = CameraSession(int(self.exposure_time_var.get()), float(self.fps_var.get()), gain=1.0,
+                                camera_factory=self.camera_factory, roi=self.get_roi(),
+                                cam_id=self.get_camera_ids()[0])
+        shutter = self.get_shutter()
+        log = self.experiment_log.log
+
+        def calibrate():
+            log("Calibrating shutter latency...", "green")
+            session.start()
+            try:
+                result = calibrate_shutter(session.read_frame, shutter, log=log)
+            except ValueError as e:
+                log(f"Calibration failed: {e}", "red")
+                return
+            finally:
+                session.close()
+            save_calibration(result)
+            log("Shutter calibration saved, it is stored in the info file of every experiment", "blue")
+
+        self.worker.run(calibrate)
+
+    def on_closing(self):
+        if self.live_view is not None:
+            self.close_live_view()
+        if self.shutter is not None:
+            self.shutter.close()
+        self.quit()
+
+    def get_camera_ids(self):
+        # The live view and the calibration use the first camera
+        return [int(value) for value in self.cameras_var.get().replace(',', ' ').split()] or [0]
+
+    def get_roi(self):
+        roi = self.roi_var.get().strip()
+        if not roi:
+            return None
+        return tuple(int(value) for value in roi.replace(',', ' ').split())
 
     def live_camera(self):
+        # The button toggles the live view
+        if self.live_view is not None:
+            self.close_live_view()
+            return
 
+        if not self.simulate:
+            # List all cameras for the uc480 backend
+            camera_list = uc480.list_cameras(backend="uc480")
+
+            # Insert camera list into console text box
+            self.update_console(str(camera_list))
+
+        # Connect to the first selected camera and start a free-running acquisition
+        self.live_session = CameraSession(int(self.exposure_time_var.get()), float(self.fps_var.get()), gain=1.0,
+                                          camera_factory=self.camera_factory, cam_id=self.get_camera_ids()[0])
+        self.live_session.start()
+
+        # Create a window to display the images
+        self.live_window = tk.Toplevel(self)
+        self.live_window.title('Thorlabs Camera')
+        self.live_window.protocol("WM_DELETE_WINDOW", self.close_live_view)
+        # No border, so mouse coordinates are image coordinates
+        video_label = tk.Label(self.live_window, borderwidth=0, highlightthickness=0)
+        video_label.pack(padx=10, pady=10)
+        tk.Label(self.live_window, text="Drag to select the ROI, click to clear it").pack(pady=5)
+
+        # Frames are grabbed and halved on a worker thread, Tk shows the newest one at up to 25 fps
+        self.live_view = LiveView(video_label, self.live_session.read_frame, downsample=2, max_display_fps=25)
+        self.live_view.overlay = self.get_roi()
+        self.live_view.start()
+
+        video_label.bind('<ButtonPress-1>', self.start_roi_selection)
+        video_label.bind('<B1-Motion>', self.update_roi_selection)
+        video_label.bind('<ButtonRelease-1>', self.finish_roi_selection)
+
+    def roi_from_event(self, event):
+        # Rectangle between the anchor and the mouse, in full sensor pixels
+        scale = self.live_view.downsample
+        x, y = max(0, event.x * scale), max(0, event.y * scale)
+        x0, y0 = self.roi_anchor
+        return min(x0, x), min(y0, y), abs(x - x0), abs(y - y0)
+
+    def start_roi_selection(self, event):
+        self.roi_anchor = (max(0, event.x * self.live_view.downsample), max(0, event.y * self.live_view.downsample))
+
+    def update_roi_selection(self, event):
+        if self.roi_anchor is not None:
+            self.live_view.overlay = self.roi_from_event(event)
+
+    def finish_roi_selection(self, event):
+        if self.roi_anchor is None:
+            return
+        x, y, width, height = self.roi_from_event(event)
+        self.roi_anchor = None
+        if width < 16 or height < 16:
+            # A click without dragging goes back to the full sensor
+            self.roi_var.set('')
+            self.live_view.overlay = None
+            self.update_console("ROI cleared, the full sensor will be recorded")
+            return
+        self.roi_var.set(f"{x}, {y}, {width}, {height}")
+        self.live_view.overlay = (x, y, width, height)
+        self.update_console(f"ROI set to {width}x{height} at ({x}, {y})")
 
-        # List all cameras for the uc480 backend
-        camera_list = uc480.list_cameras(backend="uc480")
-
-        # Insert camera list into console text box
-        self.console_text.insert(tk.END, str(camera_list) + "\n")
-        self.console_text.see(tk.END)
-        self.update()
-
-        # Connect to the first available camera
-        cam = uc480.UC480Camera(backend="uc480")
-
-        # Set up the camera (configure exposure time, gain, etc.)
-        exposure_time = int(self.exposure_time_var.get())  # Get the entered exposure time
-        cam.set_exposure(exposure_time)  # Set exposure time in microseconds
-        cam.set_gains(1.0)  # Set gain
-
-        # Start the acquisition
-        cam.start_acquisition()
-
-        # Create a named window to display the images
-        window_name = 'Thorlabs Camera'
-        cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
-
-        # Continuously capture and display images until the 'ESC' key is pressed
-        while True:
-            image_data = cam.snap()
-
-            # Convert the grayscale image to BGR
-            image_data = cv2.cvtColor(image_data, cv2.COLOR_GRAY2BGR)
-
-            # Add the text to the image
-            cv2.putText(image_data, 'Hit ESC to exit', (10, 30), cv2.FONT_HERSHEY_SIMPLEX,
-                        1, (0, 0, 255), 2, cv2.LINE_AA)
-
-            cv2.imshow(window_name, image_data)
-
-            # Break the loop if the 'ESC' key is pressed
-            if cv2.waitKey(1) == 27:
-                break
-
+    def close_live_view(self):
         # Release resources and close the window
-        cam.stop_acquisition()
-        cam.close()
-        cv2.destroyAllWindows()
+        self.live_view.stop()
+        self.live_view = None
+        self.live_session.close()
+        self.live_window.destroy()
 
-    def update_console(self, text):
-        self.console_text.insert(tk.END, text + "\n")
-        self.console_text.see(tk.END)  # Scroll the Text widget to the bottom
+    def update_console(self, text, tag=None):
+        # Shown by the worker's poll, so this is safe to call from any thread
+        self.experiment_log.log(text, tag)
 
 
     def run_experiment(self):
+        # The live view holds the camera, release it before recording
+        if self.live_view is not None:
+            self.close_live_view()
+
         num_runs = int(self.num_runs_var.get())
         experiment_info = self.info_text.get('1.0', tk.END)
 
-        # File to store the user's input and parameters
-        with open(self.file_name_var.get() + '_info.txt', 'w') as f:
-            f.write('Experiment Information:\n' + experiment_info)
-            f.write('\nExperiment Parameters:\n')
-            f.write('Number of Runs: ' + self.num_runs_var.get() + '\n')
-            f.write('Background Collection Time: ' + self.bg_time_var.get() + '\n')
-            f.write('Laser On Time: ' + self.laser_time_var.get() + '\n')
-            f.write('System Recovery Time: ' + self.recovery_time_var.get() + '\n')
-            f.write('FPS: ' + self.fps_var.get() + '\n')
-            f.write('Exposure Time: ' + self.exposure_time_var.get() + '\n')
-
-        for run in range(num_runs):
-            # Open the camera
-            cam = uc480.UC480Camera(backend="uc480")
-            exposure_time = int(self.exposure_time_var.get())  # Get the entered exposure time
-            cam.set_exposure(exposure_time)  # Set exposure time in microseconds
-            cam.set_gains(1.0)  # Set gain
-
-            # Start the acquisition
-            cam.start_acquisition()
-
-            # Define the codec and create a VideoWriter object
-            fourcc = cv2.VideoWriter_fourcc(*'MJPG')
-            out = cv2.VideoWriter(self.file_name_var.get() + str(run) + '.avi', fourcc, float(self.fps_var.get()),
-                                  (1280, 1024), isColor=False)
-
-            self.console_text.insert(tk.END, f"Beginning run {run + 1}\n","green")
-            #self.update_console(f"Beginning run {run + 1}\n")
-            self.update()
-
-            start_time = time.time()  # To get the start time
-            timestamps = []
-            toggle_count = 0
-
-            while True:
-                image_data = cam.snap()
-                out.write(image_data)
-
-                current_time = time.time()
-                timestamps.append(current_time - start_time)
-
-                if current_time - start_time > int(self.bg_time_var.get()) and toggle_count == 0:
-                    toggle_count += 1
-                    self.toggle_shutter()
-                    self.console_text.insert(tk.END, "Laser on sample now\n")
-                    self.console_text.see(tk.END)
-                    self.update()
-
-                if current_time - start_time > int(self.laser_time_var.get())+int(self.bg_time_var.get()) and toggle_count == 1:
-                    toggle_count += 1
-                    self.toggle_shutter()
-                    #self.console_text.insert(tk.END, f"Video capture complete for run {run + 1}\n")
-                    #self.console_text.see(tk.END)
-                    #self.update()
-                    self.console_text.insert(tk.END, "Resting phase\n")
-                    self.console_text.see(tk.END)
-                    self.update()
-
-                if current_time - start_time > int(self.recovery_time_var.get())+ int(self.laser_time_var.get())+int(self.bg_time_var.get()) and toggle_count == 2:
-
-                    self.console_text.insert(tk.END, f"Run {run + 1} is complete.\n","red")
-                    self.console_text.see(tk.END)
-                    self.update()
-                    end_time = time.time()
-
-                    break  # End the current run
-
-            # Close resources after the run
-            cam.stop_acquisition()
-            cam.close()
-
-            self.console_text.insert(tk.END, f"Writing video file for run {run + 1}\n")
-            self.console_text.see(tk.END)
-            self.update()
-            out.release()
-
-            # Write timestamps to a CSV file
-            self.console_text.insert(tk.END, f"Writing time file for run {run + 1}\n")
-            self.console_text.see(tk.END)
-            self.update()
-            with open(self.file_name_var.get() + '_timestamps_run' + str(run) + '.csv', 'w', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(['frame', 'timestamp'])
-                for i, timestamp in enumerate(timestamps):
-                    writer.writerow([i, timestamp])
-
-            # Time for the camera to reset
-            time.sleep(1.5)
-
-        self.console_text.insert(tk.END,"Experiment finished.\n","blue")
-        self.console_text.see(tk.END)
-        self.update()
+        parameters = {
+            'Number of Runs': self.num_runs_var.get(),
+            'Background Collection Time': self.bg_time_var.get(),
+            'Laser On Time': self.laser_time_var.get(),
+            'System Recovery Time': self.recovery_time_var.get(),
+            'FPS': self.fps_var.get(),
+            'Exposure Time': self.exposure_time_var.get(),
+        }
+
+        # Delay from shutter command to light on the sample, used to correct the analysis time axes
+        calibration = load_calibration()
+        if calibration is not None:
+            parameters['Shutter Latency'] = calibration['latency']
+
+        # The cameras are configured once and, in session mode, stay open for all runs
+        sessions = [CameraSession(int(self.exposure_time_var.get()), float(self.fps_var.get()), gain=1.0,
+                                  camera_factory=self.camera_factory, roi=self.get_roi(), cam_id=cam_id)
+                    for cam_id in self.get_camera_ids()]
+        runner = ExperimentRunner(sessions, self.get_shutter(), log=self.experiment_log.log)
+        parameters.update(runner.camera_parameters())
+        file_name = self.file_name_var.get()
+        fps = float(self.fps_var.get())
+        output_format = self.output_format_var.get()
+        run_time = float(self.bg_time_var.get()) + float(self.laser_time_var.get()) + float(self.recovery_time_var.get())
+
+        # The form is read here, the worker thread doesn't touch Tk
+        run = functools.partial(runner.run_experiment, file_name, num_runs,
+                                float(self.bg_time_var.get()), float(self.laser_time_var.get()),
+                                float(self.recovery_time_var.get()), fps,
+                                capture_mode=self.capture_mode_var.get(),
+                                keep_camera_open=self.keep_camera_open_var.get(),
+                                info=dict(parameters, **{'Experiment Information': experiment_info}),
+                                min_signal=float(self.min_signal_var.get()) if self.min_signal_var.get().strip() else None)
+
+        def experiment():
+            try:
+                # Make sure the disk can hold and keep up with all runs before the first one starts
+                preflight = run_preflight(file_name, sessions[0].frame_shape, fps, run_time, num_runs, output_format,
+                                          cameras=len(sessions), log=self.experiment_log.log)
+                if not preflight['ok']:
+                    return
+                runner.write_info_file(file_name, experiment_info, parameters)
+                run(output_format=preflight['output_format'])
+            finally:
+                # Usually closed by the runner already, but never left open when something fails
+                for session in sessions:
+                    session.close()
+
+        self.worker.run(experiment, log_file=file_name + '_log.csv')
 
     def video_viewer(self):
         # Open a video file
@@ -338,5 +442,5 @@ class MainApp(tk.Tk):
 
 
 if __name__ == "__main__":
-    app = MainApp()
+    app = MainApp(simulate="--simulate" in sys.argv)
     app.mainloop()
\ No newline at end of file
@@ -0,0 +1,100 @@
+import time
+
+from pylablib.devices import uc480
+
+
+class CameraSession:
+    """
+    Open and configure a uc480 camera once and reuse it for every run of an experiment.
+
+    Between runs only the acquisition is stopped and restarted. Instead of sleeping a
+    fixed time for the camera to reset, start() waits for the first frame of the new
+    acquisition and stores the time since the previous stop() in inter_run_gap.
+
+    With an roi only that area of the sensor is read out, which allows higher frame rates
+    and smaller files. The camera rounds the area to its own granularity, the area that was
+    actually programmed is kept in applied_roi once the camera is open.
+
+    :param exposure_time: exposure time in microseconds
+    :param fps: camera frame rate
+    :param gain: camera gain
+    :param camera_factory: callable returning a new camera, e.g. a simulated one
+    :param roi: (x, y, width, height) area of interest on the sensor, None for the full sensor
+    :param cam_id: uc480 camera ID, to pick one of several connected cameras
+    """
+
+    def __init__(self, exposure_time, fps, gain=1.0, camera_factory=None, roi=None, cam_id=0):
+        self.exposure_time = exposure_time
+        self.fps = fps
+        self.gain = gain
+        self.camera_factory = camera_factory
+        self.roi = roi
+        self.cam_id = cam_id
+        self.applied_roi = None
+        self.cam = None
+        self.last_stop_time = None
+        self.inter_run_gap = None
+
+    def open(self):
+        if self.cam is not None:
+            return
+        if self.camera_factory is not None:
+            self.cam = self.camera_factory()
+        else:
+            self.cam = uc480.UC480Camera(cam_id=self.cam_id, backend="uc480")
+        self.apply_settings()
+
+    def apply_settings(self):
+        self.cam.set_exposure(self.exposure_time)  # Set exposure time in microseconds
+        self.cam.set_gains(self.gain)  # Set gain
+        # Program the area of interest, or the full sensor so no area is left from a previous session
+        if self.roi is not None:
+            x, y, width, height = self.roi
+            hstart, hend, vstart, vend = self.cam.set_roi(x, x + width, y, y + height)[:4]
+        else:
+            hstart, hend, vstart, vend = self.cam.set_roi()[:4]
+        self.applied_roi = (hstart, vstart, hend - hstart, vend - vstart)
+        # The fastest possible frame rate depends on the area of interest, so it is set afterwards
+        self.cam.set_frame_period(1.0 / self.fps)  # Let the camera free-run at the requested fps
+
+    def configure(self, exposure_time, fps, roi=None):
+        # Change the settings between experiments, an open camera is reprogrammed without closing it
+        self.exposure_time = exposure_time
+        self.fps = fps
+        self.roi = roi
+        if self.cam is not None:
+            self.apply_settings()
+
+    @property
+    def frame_shape(self):
+        # (height, width) of the frames delivered with the applied area of interest
+        self.open()
+        return self.applied_roi[3], self.applied_roi[2]
+
+    def start(self, timeout=5.0):
+        self.open()
+        self.cam.start_acquisition()
+        # The camera is ready once the new acquisition delivers its first frame
+        self.cam.wait_for_frame(timeout=timeout)
+        if self.last_stop_time is not None:
+            self.inter_run_gap = time.perf_counter() - self.last_stop_time
+
+    def read_frame(self):
+        # Wait for the next frame of the running acquisition instead of snapping a new one
+        try:
+            self.cam.wait_for_frame(timeout=1.0)
+        except self.cam.TimeoutError:
+            return None
+        return self.cam.read_oldest_image()
+
+    def stop(self):
+        self.cam.stop_acquisition()
+        self.last_stop_time = time.perf_counter()
+
+    def close(self):
+        if self.cam is None:
+            return
+        if self.cam.acquisition_in_progress():
+            self.cam.stop_acquisition()
+        self.cam.close()
+        self.cam = None
@@ -0,0 +1,57 @@
+import csv
+import queue
+import time
+
+
+def print_log(message, tag=None):
+    # Default log of the acquisition code when no GUI is attached
+    print(message)
+
+
+class ExperimentLog:
+    """
+    Log channel between the acquisition threads and the Tk console.
+
+    log() only puts the message on a queue, so it costs the calling thread microseconds
+    and never touches Tk. The GUI calls drain() periodically from after(), inserts the
+    messages into the console in one batch and the same batch is appended to the
+    structured log file of the experiment, if one is open.
+
+    The log file is a CSV file with the wall clock time, the time.perf_counter() value
+    at which the message was logged, the tag and the message.
+    """
+
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self.file = None
+        self.writer = None
+
+    def log(self, message, tag=None):
+        self.queue.put((time.time(), time.perf_counter(), tag, message))
+
+    def open_file(self, file_name):
+        self.close_file()
+        self.file = open(file_name, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(['time', 'perf_counter', 'tag', 'message'])
+
+    def close_file(self):
+        if self.file is not None:
+            self.file.close()
+        self.file = None
+        self.writer = None
+
+    def drain(self, max_messages=1000):
+        """Return the queued (wall time, perf_counter, tag, message) entries, writing them to the log file."""
+        entries = []
+        while len(entries) < max_messages:
+            try:
+                entries.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if entries and self.writer is not None:
+            for wall_time, perf_time, tag, message in entries:
+                self.writer.writerow([time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(wall_time))
+                                      + f"{wall_time % 1:.3f}"[1:], perf_time, tag or '', message])
+            self.file.flush()
+        return entries
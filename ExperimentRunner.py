@@ -0,0 +1,298 @@
+import threading
+import time
+
+import numpy as np
+
+from AcquisitionPipeline import AcquisitionPipeline, RingBufferCapture, VideoFileWriter, write_timestamps
+from AcquisitionTelemetry import AcquisitionTelemetry
+from ExperimentLog import print_log
+from RawFrameContainer import RawFrameWriter
+from RunScheduler import RunScheduler
+from ShutterController import write_shutter_events
+from SignalMonitor import SignalMonitor
+
+
+class ExperimentRunner:
+    """
+    Run the runs of a uc480 thermal lensing experiment and write their files.
+
+    Each run records background, laser-on and recovery phases through the selected
+    capture pipeline and writes <name>N.avi or <name>N.tlraw, <name>_timestamps_runN.csv,
+    <name>_shutter_runN.csv, <name>_metrics_runN.csv and <name>_signal_runN.csv. There is
+    no Tk in here, so the GUI, the benchmark and scripts can all drive the same code.
+
+    With several camera sessions every camera gets its own capture thread and writer, all
+    runs share one shutter schedule, and the camera files are named <name>_camK..., with
+    the videos as <name>_camK_N.avi or <name>_camK_N.tlraw. The
+    frame timestamps of all cameras and the shutter events are measured from the same
+    time.perf_counter() start time, so they line up directly.
+
+    A SignalMonitor watches every run, and a run whose thermal lens signal stays below
+    min_signal is recorded again straight away instead of being found out in the analysis.
+    The signal of the first camera decides.
+
+    :param session: CameraSession, or a list of CameraSessions recorded together
+    :param shutter: ShutterController used for all runs
+    :param log: callable(message, tag=None) receiving progress messages
+    :param telemetry_interval: seconds between two telemetry lines in the log during a run, None for none
+    """
+
+    def __init__(self, session, shutter, log=print_log, telemetry_interval=1.0):
+        self.sessions = list(session) if isinstance(session, (list, tuple)) else [session]
+        self.session = self.sessions[0]
+        self.shutter = shutter
+        self.log = log
+        self.telemetry_interval = telemetry_interval
+
+    def write_info_file(self, file_name, experiment_info, parameters):
+        # File to store the user's input and parameters
+        with open(file_name + '_info.txt', 'w') as f:
+            f.write('Experiment Information:\n' + experiment_info)
+            f.write('\nExperiment Parameters:\n')
+            for name, value in parameters.items():
+                f.write(name + ': ' + str(value) + '\n')
+
+    def camera_parameters(self):
+        # The areas the cameras actually record, rounded to the sensors' granularity
+        parameters = {}
+        if len(self.sessions) > 1:
+            parameters['Cameras'] = ', '.join(str(session.cam_id) for session in self.sessions)
+        for k, session in enumerate(self.sessions):
+            session.open()
+            x, y, width, height = session.applied_roi
+            suffix = f" cam{k}" if len(self.sessions) > 1 else ""
+            parameters['ROI Offset' + suffix] = f"{x}, {y}"
+            parameters['ROI Size' + suffix] = f"{width}, {height}"
+        return parameters
+
+    def camera_file_names(self, file_name):
+        # A single camera keeps the plain file names
+        if len(self.sessions) == 1:
+            return [file_name]
+        return [f"{file_name}_cam{k}" for k in range(len(self.sessions))]
+
+    def stop_captures(self, captures):
+        # Every capture is stopped even if one of them fails, the first error is raised afterwards
+        errors = []
+        for capture in captures:
+            try:
+                capture.stop()
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+    def run_file_name(self, camera_name, run):
+        # With several cameras the run is separated from the camera number, <name>_cam1_10 and <name>_cam11_0
+        if len(self.sessions) == 1:
+            return camera_name + str(run)
+        return f"{camera_name}_{run}"
+
+    def run_experiment(self, file_name, num_runs, background_time, laser_time, recovery_time, fps,
+                       capture_mode='Stream to disk', output_format='AVI (MJPG)', keep_camera_open=True,
+                       frame_shape=None, info=None, close_camera=True, min_signal=None, max_reshoots=1):
+        """
+        Record num_runs runs and return a list with a dict of statistics per run.
+
+        :param capture_mode: 'Stream to disk' or 'RAM buffer'
+        :param output_format: 'AVI (MJPG)' or 'Raw (lossless)'
+        :param frame_shape: (height, width) of the camera frames, by default that of each session's area of interest
+        :param info: parameters stored in the header of raw containers
+        :param close_camera: close the camera after the last run, False to reuse it for another experiment
+        :param min_signal: runs with a lower mean signal during the laser phase are re-shot, None to keep all runs
+        :param max_reshoots: maximum number of times one run is re-shot
+        """
+        if frame_shape is None:
+            frame_shapes = [session.frame_shape for session in self.sessions]
+        else:
+            frame_shapes = [frame_shape] * len(self.sessions)
+        camera_names = self.camera_file_names(file_name)
+
+        # Event deadlines are computed once for all runs
+        scheduler = RunScheduler(background_time, laser_time, recovery_time)
+
+        # In RAM buffer mode two buffers per camera alternate, so one run can be written to
+        # disk while the next one is recording
+        ram_buffer_mode = capture_mode == 'RAM buffer'
+        if ram_buffer_mode:
+            capacity = int(np.ceil(fps * scheduler.events[-1][1] * 1.1)) + 10
+            ring_buffers = [[RingBufferCapture(session.read_frame, shape, capacity) for _ in range(2)]
+                            for session, shape in zip(self.sessions, frame_shapes)]
+            flush_threads = [[None, None] for _ in self.sessions]
+
+        results = []
+        run = 0
+        reshoots = 0
+        # Started captures, and writers no capture or flush thread closes yet, cleaned up if a run
+        # fails so the cameras and files are never left open
+        active_captures = []
+        open_writers = []
+        try:
+            while run < num_runs:
+                # Start the acquisitions, opening the cameras if needed
+                for session in self.sessions:
+                    session.start()
+                    if session.inter_run_gap is not None:
+                        self.log(f"Camera ready {session.inter_run_gap:.2f} s after previous run")
+
+                # Create the writers for this run, each camera has its own capture and writer threads
+                shutter_events = []
+                writers, telemetries, monitors, captures = [], [], [], []
+                for k, (session, name, shape) in enumerate(zip(self.sessions, camera_names, frame_shapes)):
+                    if output_format == 'Raw (lossless)':
+                        writer = RawFrameWriter(self.run_file_name(name, run) + '.tlraw', fps, shutter_events=shutter_events, info=info)
+                    else:
+                        writer = VideoFileWriter(self.run_file_name(name, run) + '.avi', fps, (shape[1], shape[0]), fourcc='MJPG')
+                    telemetry = AcquisitionTelemetry(fps)
+                    monitor = SignalMonitor(background_time, laser_time)
+                    if ram_buffer_mode:
+                        # Make sure this buffer has been written out by the run before last
+                        if flush_threads[k][run % 2] is not None:
+                            flush_threads[k][run % 2].join()
+                        capture = ring_buffers[k][run % 2]
+                        capture.telemetry = telemetry
+                        capture.monitors = [monitor]
+                    else:
+                        # The monitor is a second, lossy consumer, the video writer always comes first
+                        capture = AcquisitionPipeline(session.read_frame, [writer, monitor], telemetry=telemetry)
+                    writers.append(writer)
+                    open_writers.append(writer)
+                    telemetries.append(telemetry)
+                    monitors.append(monitor)
+                    captures.append(capture)
+
+                self.log(f"Beginning run {run + 1}", "green")
+
+                # All cameras and the shutter events share this start time
+                start_time = time.perf_counter()  # To get the start time
+                for capture, writer in zip(captures, writers):
+                    capture.start(start_time)
+                    active_captures.append(capture)
+                    if not ram_buffer_mode:
+                        open_writers.remove(writer)  # The pipeline closes it when it's stopped
+
+                def toggle(event, message):
+                    toggle_time, latency = self.shutter.toggle()
+                    shutter_events.append((event, toggle_time - start_time, latency))
+                    self.log(f"Shutter toggled ({latency * 1000:.2f} ms)")
+                    self.log(message)
+
+                # Frames are captured and written by the pipeline threads, this thread sleeps between shutter events
+                # and shows the telemetry of the run at a throttled rate
+                tick = None
+                if self.telemetry_interval is not None:
+                    tick = lambda: self.log(self.format_status(telemetries, monitors))
+                scheduler.run(start_time, {
+                    'laser_on': lambda: toggle('laser_on', "Laser on sample now"),
+                    'laser_off': lambda: toggle('laser_off', "Resting phase"),
+                    'run_end': lambda: self.log(f"Run {run + 1} is complete.", "red"),
+                }, tick=tick, tick_interval=self.telemetry_interval or 1.0)
+
+                stopping, active_captures = active_captures, []
+                self.stop_captures(stopping)
+                signal = monitors[0].signal()
+                for k, (capture, telemetry) in enumerate(zip(captures, telemetries)):
+                    camera = f"Camera {k}: " if len(self.sessions) > 1 else ""
+                    self.log(camera + capture.report() + "\n" + telemetry.summary())
+                self.log(scheduler.report())
+                self.log(f"Run {run + 1}" + self.format_signal(signal))
+
+                # Stop the acquisitions and only close the cameras if they aren't kept open
+                for session in self.sessions:
+                    session.stop()
+                    if not keep_camera_open:
+                        session.close()
+
+                if min_signal is not None and (signal is None or signal < min_signal) and reshoots < max_reshoots:
+                    # The files of this run are overwritten by the next attempt
+                    reshoots += 1
+                    for writer in open_writers:
+                        writer.close()
+                    open_writers = []
+                    self.log(f"Signal below {min_signal}, recording run {run + 1} again", "red")
+                    continue
+
+                write_shutter_events(file_name + '_shutter_run' + str(run) + '.csv', shutter_events)
+
+                if ram_buffer_mode:
+                    # Write the video and time files in the background while the next run records
+                    self.log(f"Writing video and time files for run {run + 1} in the background")
+                else:
+                    self.log(f"Writing time file for run {run + 1}")
+                open_writers = []
+                cameras = []
+                for k, name in enumerate(camera_names):
+                    timestamps_file = name + '_timestamps_run' + str(run) + '.csv'
+                    metrics_file = name + '_metrics_run' + str(run) + '.csv'
+                    if ram_buffer_mode:
+                        flush_threads[k][run % 2] = threading.Thread(
+                            target=self.flush_ring_buffer, args=(captures[k], writers[k], timestamps_file, metrics_file),
+                            daemon=True)
+                        flush_threads[k][run % 2].start()
+                        frames_dropped = captures[k].frames_dropped
+                    else:
+                        # Write timestamps to a CSV file
+                        write_timestamps(timestamps_file, writers[k].timestamps)
+                        telemetries[k].write_csv(metrics_file)
+                        frames_dropped = captures[k].frames_dropped[0]
+                    monitors[k].write_csv(name + '_signal_run' + str(run) + '.csv')
+                    cameras.append({
+                        'frames_captured': captures[k].frames_captured,
+                        'frames_dropped': frames_dropped,
+                        'signal': monitors[k].signal(),
+                    })
+
+                results.append({
+                    'run': run,
+                    'frames_captured': sum(camera['frames_captured'] for camera in cameras),
+                    'frames_dropped': sum(camera['frames_dropped'] for camera in cameras),
+                    'duration': scheduler.events[-1][1],
+                    'scheduling_errors': dict(scheduler.errors),
+                    'toggle_latencies': [latency for _, _, latency in shutter_events],
+                    'signal': signal,
+                    'reshoots': reshoots,
+                    'cameras': cameras,
+                })
+                run += 1
+                reshoots = 0
+
+            if close_camera:
+                for session in self.sessions:
+                    session.close()
+
+            if ram_buffer_mode:
+                self.log("Waiting for buffered runs to be written...")
+
+        finally:
+            for capture in active_captures:
+                try:
+                    capture.stop()
+                except Exception:
+                    pass  # The error that ended the experiment is the one reported
+            for writer in open_writers:
+                writer.close()
+            if ram_buffer_mode:
+                for camera_threads in flush_threads:
+                    for flush_thread in camera_threads:
+                        if flush_thread is not None:
+                            flush_thread.join()
+            if close_camera:
+                for session in self.sessions:
+                    session.close()
+
+        self.log("Experiment finished.", "blue")
+        return results
+
+    def format_signal(self, signal):
+        return f", signal {signal:.2f}" if signal is not None else ", no signal yet"
+
+    def format_status(self, telemetries, monitors):
+        if len(telemetries) == 1:
+            return telemetries[0].status() + self.format_signal(monitors[0].latest)
+        return "\n".join(f"Camera {k}: " + telemetry.status() + self.format_signal(monitor.latest)
+                         for k, (telemetry, monitor) in enumerate(zip(telemetries, monitors)))
+
+    def flush_ring_buffer(self, capture, writer, timestamps_file, metrics_file):
+        capture.flush(writer)
+        write_timestamps(timestamps_file, writer.timestamps)
+        capture.telemetry.write_csv(metrics_file)
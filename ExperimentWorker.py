@@ -0,0 +1,68 @@
+import threading
+import tkinter as tk
+
+
+class ExperimentWorker:
+    """
+    Run experiments and calibrations on a worker thread and show their log in a Tk console.
+
+    Tk stays responsive, the worker only talks to the GUI through the experiment log.
+    poll() runs from after() on the Tk thread, shows everything logged since the last
+    poll in one batch and enables the buttons again once the worker has finished. Only
+    one worker runs at a time, and the buttons that would start another one or use the
+    camera or shutter are disabled meanwhile.
+
+    :param widget: Tk widget that schedules the polls
+    :param console: Text widget the log is shown in, with the tags used for the messages
+    :param experiment_log: ExperimentLog the worker logs to
+    :param buttons: buttons disabled while the worker runs
+    :param interval: milliseconds between polls
+    """
+
+    def __init__(self, widget, console, experiment_log, buttons, interval=100):
+        self.widget = widget
+        self.console = console
+        self.experiment_log = experiment_log
+        self.buttons = tuple(buttons)
+        self.interval = interval
+        self.thread = None
+        self.widget.after(self.interval, self.poll)
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def run(self, target, log_file=None):
+        if self.thread is not None:
+            self.experiment_log.log("Wait until the running experiment has finished", "red")
+            return
+        if log_file is not None:
+            self.experiment_log.open_file(log_file)
+
+        def work():
+            try:
+                target()
+            except Exception as e:
+                self.experiment_log.log(f"Error: {e}", "red")
+                raise
+
+        for button in self.buttons:
+            button.config(state=tk.DISABLED)
+        self.thread = threading.Thread(target=work, daemon=True)
+        self.thread.start()
+
+    def poll(self):
+        # Show everything logged since the last poll in one batch
+        finished = self.thread is not None and not self.thread.is_alive()
+        entries = self.experiment_log.drain()
+        for _, _, tag, message in entries:
+            self.console.insert(tk.END, message + "\n", tag)
+        if entries:
+            self.console.see(tk.END)  # Scroll the Text widget to the bottom
+
+        if finished:
+            self.thread = None
+            self.experiment_log.close_file()
+            for button in self.buttons:
+                button.config(state=tk.NORMAL)
+        self.widget.after(self.interval, self.poll)
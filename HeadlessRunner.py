@@ -0,0 +1,206 @@
+"""
+Run a sweep of uc480 thermal lensing experiments without the GUI.
+
+The sweep is a JSON file with the same parameters as the AquisitionProgram form. Any
+parameter given as a list is swept, and every combination of the swept values is
+recorded as one experiment with its own _info.txt, videos and time files. The cameras
+and the shutter port are opened once and reused for the whole sweep; with several
+camera IDs every run is recorded by all of them.
+
+    {
+        "file_name": "D:/data/ethanol",
+        "com_port": "COM3",
+        "experiment_information": "Sample: ethanol\\nInvestigator: \\nComments: ",
+        "num_runs": 3,
+        "background_time": 2,
+        "laser_time": [2, 4, 8],
+        "recovery_time": 4,
+        "fps": 10.0,
+        "exposure_time": [100, 200],
+        "roi": null,
+        "cameras": [0],
+        "capture_mode": "Stream to disk",
+        "output_format": "AVI (MJPG)"
+    }
+
+records six experiments named ethanol_laser_time2_exposure_time100, ethanol_laser_time2_exposure_time200, ...
+each with the usual _info.txt, video and _timestamps_runN.csv files.
+
+    python HeadlessRunner.py sweep.json
+    python HeadlessRunner.py sweep.json --dry-run
+"""
+import argparse
+import functools
+import itertools
+import json
+import os
+import sys
+import time
+
+import serial
+
+from AcquisitionPreflight import run_preflight
+from CameraSession import CameraSession
+from ExperimentLog import print_log
+from ExperimentRunner import ExperimentRunner
+from ShutterCalibration import load_calibration
+from ShutterController import ShutterController
+from SimulatedDevices import SimulatedLaser, SimulatedSerial, SimulatedUC480Camera
+
+DEFAULTS = {
+    'com_port': 'COM3',
+    'experiment_information': "Sample: \nInvestigator: \nComments: ",
+    'num_runs': 1,
+    'background_time': 2.0,
+    'laser_time': 4.0,
+    'recovery_time': 2.0,
+    'fps': 10.0,
+    'exposure_time': 100,
+    'roi': None,
+    'cameras': [0],
+    'capture_mode': 'Stream to disk',
+    'output_format': 'AVI (MJPG)',
+    'keep_camera_open': True,
+    'min_signal': None,
+}
+
+# Parameters that are a list by themselves and are only swept when given as a list of lists
+LIST_PARAMETERS = ['roi']
+
+# Parameters that are the same for the whole sweep
+FIXED_PARAMETERS = ['file_name', 'com_port', 'cameras']
+
+
+def expand_sweep(sweep):
+    """Return the list of experiments, each a (file name, settings dict) pair, of a sweep definition."""
+    settings = dict(DEFAULTS, **sweep)
+    swept = []
+    for name, value in settings.items():
+        if name in FIXED_PARAMETERS or not isinstance(value, list):
+            continue
+        if name in LIST_PARAMETERS and not isinstance(value[0], list):
+            continue
+        swept.append(name)
+
+    experiments = []
+    for values in itertools.product(*(settings[name] for name in swept)):
+        experiment = dict(settings)
+        experiment.update(zip(swept, values))
+        suffix = ''.join(f"_{name}{format_value(value)}" for name, value in zip(swept, values))
+        experiments.append((settings['file_name'] + suffix, experiment))
+    return experiments
+
+
+def format_value(value):
+    if isinstance(value, list):
+        return 'x'.join(str(v) for v in value)
+    return str(value)
+
+
+def info_parameters(experiment):
+    # Same keys as the info file written by AquisitionProgram
+    parameters = {
+        'Number of Runs': experiment['num_runs'],
+        'Background Collection Time': experiment['background_time'],
+        'Laser On Time': experiment['laser_time'],
+        'System Recovery Time': experiment['recovery_time'],
+        'FPS': experiment['fps'],
+        'Exposure Time': experiment['exposure_time'],
+    }
+    calibration = load_calibration()
+    if calibration is not None:
+        parameters['Shutter Latency'] = calibration['latency']
+    return parameters
+
+
+def experiment_duration(experiment):
+    run_time = experiment['background_time'] + experiment['laser_time'] + experiment['recovery_time']
+    return experiment['num_runs'] * run_time
+
+
+def is_complete(runner, file_name, experiment):
+    # The time file of the last run is only written once the run is on disk, for every camera
+    last_run = int(experiment['num_runs']) - 1
+    return all(os.path.exists(f"{name}_timestamps_run{last_run}.csv") for name in runner.camera_file_names(file_name))
+
+
+def run_sweep(experiments, sessions, shutter, log=print_log, skip_existing=False):
+    runner = ExperimentRunner(sessions, shutter, log=log)
+    try:
+        for i, (file_name, experiment) in enumerate(experiments):
+            if skip_existing and is_complete(runner, file_name, experiment):
+                log(f"Skipping {file_name}, already recorded")
+                continue
+            log(f"Experiment {i + 1}/{len(experiments)}: {file_name}", "blue")
+
+            # The cameras stay open, only their settings change between experiments
+            for session in sessions:
+                session.configure(int(experiment['exposure_time']), float(experiment['fps']), experiment['roi'])
+            parameters = info_parameters(experiment)
+            parameters.update(runner.camera_parameters())
+
+            # An experiment the disk can't take is skipped, smaller ones later in the sweep may still fit
+            preflight = run_preflight(file_name, sessions[0].frame_shape, float(experiment['fps']),
+                                      experiment_duration(experiment) / int(experiment['num_runs']),
+                                      int(experiment['num_runs']), experiment['output_format'],
+                                      cameras=len(sessions), log=log)
+            if not preflight['ok']:
+                continue
+
+            runner.write_info_file(file_name, experiment['experiment_information'], parameters)
+            runner.run_experiment(file_name, int(experiment['num_runs']), float(experiment['background_time']),
+                                  float(experiment['laser_time']), float(experiment['recovery_time']),
+                                  float(experiment['fps']), capture_mode=experiment['capture_mode'],
+                                  output_format=preflight['output_format'],
+                                  keep_camera_open=experiment['keep_camera_open'],
+                                  info=dict(parameters, **{'Experiment Information': experiment['experiment_information']}),
+                                  close_camera=False, min_signal=experiment['min_signal'])
+    finally:
+        for session in sessions:
+            session.close()
+        shutter.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a sweep of thermal lensing experiments without the GUI.")
+    parser.add_argument('sweep', help="JSON file with the sweep definition")
+    parser.add_argument('--dry-run', action='store_true', help="list the experiments without recording them")
+    parser.add_argument('--skip-existing', action='store_true',
+                        help="skip experiments whose files are already complete, e.g. to resume a sweep")
+    parser.add_argument('--simulate', action='store_true', help="use the simulated camera and shutter")
+    args = parser.parse_args()
+
+    with open(args.sweep) as f:
+        sweep = json.load(f)
+    if 'file_name' not in sweep:
+        sys.exit("The sweep definition needs a file_name")
+    experiments = expand_sweep(sweep)
+
+    total_time = sum(experiment_duration(experiment) for _, experiment in experiments)
+    print(f"{len(experiments)} experiments, {total_time / 60:.1f} minutes of recording")
+    if args.dry_run:
+        for file_name, experiment in experiments:
+            print(f"{file_name}: {experiment['num_runs']} runs of {experiment_duration(experiment) / experiment['num_runs']:.1f} s")
+        return
+
+    settings = experiments[0][1]
+    if args.simulate:
+        laser = SimulatedLaser()
+        camera_factory = lambda: SimulatedUC480Camera(laser=laser)
+        serial_class = functools.partial(SimulatedSerial, laser=laser)
+    else:
+        camera_factory = None
+        serial_class = serial.Serial
+    # The cameras can't change during a sweep, they are opened once
+    sessions = [CameraSession(int(settings['exposure_time']), float(settings['fps']), gain=1.0,
+                              camera_factory=camera_factory, roi=settings['roi'], cam_id=cam_id)
+                for cam_id in settings['cameras']]
+    shutter = ShutterController(settings['com_port'], serial_class=serial_class)
+
+    start_time = time.perf_counter()
+    run_sweep(experiments, sessions, shutter, skip_existing=args.skip_existing)
+    print(f"Sweep finished in {(time.perf_counter() - start_time) / 60:.1f} minutes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import threading
+
+import numpy as np
+from PIL import Image
+from PIL import ImageTk
+
+
+class LiveView:
+    """
+    Show a live camera feed in a Tk label without blocking the Tk mainloop.
+
+    A worker thread grabs frames continuously, downsamples them and keeps only the newest
+    one in a single slot, so a slow display never builds up a backlog. The Tk thread
+    picks up the newest frame via after() at no more than max_display_fps and is the
+    only thread that creates PhotoImages or touches the label. If overlay is set to an
+    (x, y, width, height) rectangle in full frame pixels, it is outlined on the display.
+
+    :param widget: Tk label the frames are shown in
+    :param grab_frame: callable returning the next frame as an RGB or greyscale array, or None
+    :param downsample: keep every n-th row and column
+    :param max_display_fps: maximum number of display updates per second
+    """
+
+    def __init__(self, widget, grab_frame, downsample=1, max_display_fps=25):
+        self.widget = widget
+        self.grab_frame = grab_frame
+        self.downsample = downsample
+        self.display_interval = max(1, int(1000 / max_display_fps))
+        self.overlay = None
+
+        self.frames_captured = 0
+        self.frames_displayed = 0
+
+        self._lock = threading.Lock()
+        self._newest = None
+        self._running = False
+        self._thread = None
+        self._after_id = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self._thread.start()
+        self._after_id = self.widget.after(self.display_interval, self._display)
+
+    def stop(self):
+        self._running = False
+        if self._after_id is not None:
+            self.widget.after_cancel(self._after_id)
+            self._after_id = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def _capture_loop(self):
+        while self._running:
+            frame = self.grab_frame()
+            if frame is None:
+                continue
+            small = np.ascontiguousarray(frame[::self.downsample, ::self.downsample])
+            with self._lock:
+                self._newest = small
+                self.frames_captured += 1
+
+    def _display(self):
+        with self._lock:
+            frame = self._newest
+            self._newest = None
+        if frame is not None:
+            if self.overlay is not None:
+                self._draw_overlay(frame, self.overlay)
+            imgtk = ImageTk.PhotoImage(image=Image.fromarray(frame))
+            self.widget.imgtk = imgtk  # Keep a reference so the image isn't garbage collected
+            self.widget.configure(image=imgtk)
+            self.frames_displayed += 1
+        if self._running:
+            self._after_id = self.widget.after(self.display_interval, self._display)
+
+    def _draw_overlay(self, frame, rectangle):
+        x, y, width, height = (value // self.downsample for value in rectangle)
+        x1 = min(x + width, frame.shape[1]) - 1
+        y1 = min(y + height, frame.shape[0]) - 1
+        if x < 0 or y < 0 or x1 < x or y1 < y:
+            return
+        frame[y, x:x1 + 1] = 255
+        frame[y1, x:x1 + 1] = 255
+        frame[y:y1 + 1, x] = 255
+        frame[y:y1 + 1, x1] = 255
@@ -0,0 +1,112 @@
+import csv
+import threading
+
+import numpy as np
+
+
+class TimestampedVideoOutput:
+    """
+    File-like output for PiCamera.start_recording that keeps the PTS of every frame.
+
+    picamera calls write() with the encoder output. Once a frame is complete,
+    camera.frame.timestamp holds its presentation timestamp in microseconds. With the
+    camera in clock_mode='raw' that is the same clock as camera.timestamp, so shutter
+    toggles stamped with camera.timestamp can be placed exactly on the frame time axis.
+
+    :param camera: the recording PiCamera, opened with clock_mode='raw'
+    :param file_name: path of the .h264 file
+    """
+
+    def __init__(self, camera, file_name):
+        self.camera = camera
+        self.file_name = file_name
+        self.video_output = open(file_name, 'wb')
+        self.pts = []
+
+    def write(self, buf):
+        self.video_output.write(buf)
+        frame = self.camera.frame
+        # SPS headers and partial frames have no timestamp of their own
+        if frame.complete and frame.timestamp is not None:
+            self.pts.append(frame.timestamp)
+        return len(buf)
+
+    def flush(self):
+        self.video_output.flush()
+
+    def close(self):
+        self.video_output.close()
+
+    @property
+    def start_pts(self):
+        return self.pts[0] if self.pts else None
+
+    def write_timestamps(self, file_name):
+        # Frame times in seconds since the first recorded frame
+        with open(file_name, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['frame', 'timestamp'])
+            for i, pts in enumerate(self.pts):
+                writer.writerow([i, (pts - self.start_pts) / 1e6])
+
+
+class DiscardVideoOutput:
+    """Output that throws the encoded video away, so recording can go on between runs."""
+
+    def write(self, buf):
+        return len(buf)
+
+    def flush(self):
+        pass
+
+
+class TimestampedFrameOutput:
+    """
+    Output for PiCamera.start_recording(format='rgb') that hands out the newest frame and its PTS.
+
+    Frames captured from the video port have no timestamp, only recorded ones do, so
+    frames that must be timed on the camera clock are recorded unencoded into this
+    output. grab() returns each new frame once and sets timestamp to its PTS in
+    microseconds, so it can serve as grab_frame of an AcquisitionPipeline with
+    frame_time reading timestamp.
+
+    :param camera: the recording PiCamera, opened with clock_mode='raw'
+    """
+
+    def __init__(self, camera):
+        self.camera = camera
+        self.timestamp = None
+        self._buffer = bytearray()
+        self._frame = None
+        self._frame_timestamp = None
+        self._new_frame = threading.Condition()
+
+    def write(self, buf):
+        # A frame may arrive in several writes, it is complete once the camera says so
+        self._buffer += buf
+        frame = self.camera.frame
+        if frame.complete and frame.timestamp is not None:
+            width, height = self.camera.resolution
+            # The camera pads rows to 32 pixels and frames to 16 rows
+            padded_width = (width + 31) // 32 * 32
+            padded_height = (height + 15) // 16 * 16
+            rgb = np.frombuffer(bytes(self._buffer), dtype=np.uint8).reshape(padded_height, padded_width, 3)
+            with self._new_frame:
+                self._frame = rgb[:height, :width]
+                self._frame_timestamp = frame.timestamp
+                self._new_frame.notify()
+            self._buffer = bytearray()
+        return len(buf)
+
+    def grab(self, timeout=0.1):
+        """Return the frame written since the last call, or None if none came within timeout seconds."""
+        with self._new_frame:
+            if self._frame is None:
+                self._new_frame.wait(timeout)
+            frame, self._frame = self._frame, None
+            if frame is not None:
+                self.timestamp = self._frame_timestamp
+        return frame
+
+    def flush(self):
+        pass
@@ -0,0 +1,124 @@
+import json
+import struct
+
+import numpy as np
+
+# File layout of a .tlraw container:
+#   bytes 0-23     magic, metadata offset and metadata length (little endian uint64)
+#   DATA_OFFSET    frames stored back to back in chunks of chunk_frames frames
+#   metadata       UTF-8 JSON with shape, dtype, fps, timestamps, shutter events and info
+# Because the frames are contiguous they can be memory-mapped directly as one array.
+MAGIC = b'TLRAW001'
+PREAMBLE = struct.Struct('<8sQQ')
+DATA_OFFSET = 4096
+
+
+class RawFrameWriter:
+    """
+    Write uint8/uint16 frames losslessly into a chunked .tlraw container.
+
+    Frames are collected into a chunk buffer and written chunk_frames at a time. The
+    metadata is written when the file is closed, so the shutter_events list and the info
+    dict may still be filled in while the run is recording.
+
+    :param file_name: path of the container
+    :param fps: nominal frame rate
+    :param chunk_frames: number of frames per chunk
+    :param shutter_events: list of (event name, time since run start, latency) tuples
+    :param info: dict with the experiment information and parameters of the _info.txt file
+    """
+
+    def __init__(self, file_name, fps, chunk_frames=32, shutter_events=None, info=None):
+        self.file_name = file_name
+        self.fps = fps
+        self.chunk_frames = chunk_frames
+        self.shutter_events = [] if shutter_events is None else shutter_events
+        self.info = {} if info is None else info
+        self.timestamps = []
+        self.frame_count = 0
+        self.bytes_written = 0
+
+        self.f = open(file_name, 'wb')
+        self.f.write(PREAMBLE.pack(MAGIC, 0, 0))
+        self.f.seek(DATA_OFFSET)
+        self.chunk = None
+        self.chunk_fill = 0
+
+    def write(self, frame, timestamp):
+        if self.chunk is None:
+            # The frame shape and dtype are fixed by the first frame
+            if frame.dtype not in (np.uint8, np.uint16):
+                raise ValueError(f"Unsupported frame dtype {frame.dtype}, expected uint8 or uint16")
+            self.chunk = np.zeros((self.chunk_frames,) + frame.shape, dtype=frame.dtype)
+        self.chunk[self.chunk_fill] = frame
+        self.chunk_fill += 1
+        self.timestamps.append(float(timestamp))
+        self.frame_count += 1
+        if self.chunk_fill == self.chunk_frames:
+            self._write_chunk()
+
+    def _write_chunk(self):
+        # Every chunk has the same size on disk, the last one is padded with empty frames
+        self.chunk[self.chunk_fill:] = 0
+        self.f.write(self.chunk.tobytes())
+        self.bytes_written += self.chunk.nbytes
+        self.chunk_fill = 0
+
+    def close(self):
+        if self.chunk is not None and self.chunk_fill > 0:
+            self._write_chunk()
+
+        metadata = {
+            'shape': list(self.chunk.shape[1:]) if self.chunk is not None else [],
+            'dtype': str(self.chunk.dtype) if self.chunk is not None else 'uint8',
+            'fps': self.fps,
+            'frame_count': self.frame_count,
+            'chunk_frames': self.chunk_frames,
+            'data_offset': DATA_OFFSET,
+            'timestamps': self.timestamps,
+            'shutter_events': [list(event) for event in self.shutter_events],
+            'info': self.info,
+        }
+        metadata_bytes = json.dumps(metadata).encode('utf-8')
+        metadata_offset = self.f.tell()
+        self.f.write(metadata_bytes)
+        self.f.seek(0)
+        self.f.write(PREAMBLE.pack(MAGIC, metadata_offset, len(metadata_bytes)))
+        self.f.close()
+
+
+class RawFrameReader:
+    """
+    Open a .tlraw container; frames is a read-only memory map of shape (frame_count, height, width).
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        with open(file_name, 'rb') as f:
+            magic, metadata_offset, metadata_length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+            if magic != MAGIC:
+                raise ValueError(f"{file_name} is not a raw frame container")
+            if metadata_offset == 0:
+                raise ValueError(f"{file_name} was not closed properly and has no metadata")
+            f.seek(metadata_offset)
+            self.metadata = json.loads(f.read(metadata_length).decode('utf-8'))
+
+        self.shape = tuple(self.metadata['shape'])
+        self.dtype = np.dtype(self.metadata['dtype'])
+        self.fps = self.metadata['fps']
+        self.timestamps = np.array(self.metadata['timestamps'])
+        self.shutter_events = [tuple(event) for event in self.metadata['shutter_events']]
+        self.info = self.metadata['info']
+
+        frame_count = self.metadata['frame_count']
+        if frame_count:
+            self.frames = np.memmap(file_name, dtype=self.dtype, mode='r', offset=self.metadata['data_offset'],
+                                    shape=(frame_count,) + self.shape)
+        else:
+            self.frames = np.zeros((0,) + self.shape, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, index):
+        return self.frames[index]
@@ -0,0 +1,77 @@
+import time
+
+
+class RunScheduler:
+    """
+    Fire the events of one run (laser on, laser off, end of run) at fixed deadlines.
+
+    The deadlines are computed once from the phase durations and measured on the
+    time.perf_counter() clock, which is monotonic. The calling thread sleeps until
+    shortly before each deadline and only polls for the last spin_time seconds, so
+    the CPU stays free for the camera and encoder. The lateness of every event is kept
+    in self.errors so it can be reported after the run. An optional tick callback is
+    run every tick_interval seconds while waiting, but never close to a deadline.
+
+    :param background_time: seconds of background before the laser is switched on
+    :param laser_time: seconds the laser stays on
+    :param recovery_time: seconds recorded after the laser is switched off
+    :param spin_time: seconds before a deadline at which sleeping gives way to polling
+    :param tick_guard: ticks are skipped when a deadline is less than this many seconds away
+    """
+
+    def __init__(self, background_time, laser_time, recovery_time, spin_time=0.001, tick_guard=0.05):
+        self.events = [
+            ('laser_on', background_time),
+            ('laser_off', background_time + laser_time),
+            ('run_end', background_time + laser_time + recovery_time),
+        ]
+        self.spin_time = spin_time
+        self.tick_guard = tick_guard
+        self.errors = {}
+        self._tick = None
+        self._tick_interval = None
+        self._next_tick = None
+
+    def run(self, start_time, callbacks, tick=None, tick_interval=1.0):
+        """
+        Block until every event has fired.
+
+        :param start_time: time.perf_counter() value the deadlines are measured from
+        :param callbacks: dict mapping event names to callables run when the event fires
+        :param tick: callable run periodically while waiting, e.g. to display telemetry
+        :param tick_interval: seconds between two ticks
+        """
+        self.errors = {}
+        self._tick = tick
+        self._tick_interval = tick_interval
+        self._next_tick = start_time + tick_interval
+        try:
+            for name, offset in self.events:
+                deadline = start_time + offset
+                self.errors[name] = self.wait_until(deadline) - deadline
+                callback = callbacks.get(name)
+                if callback is not None:
+                    callback()
+        finally:
+            self._tick = None
+
+    def wait_until(self, deadline):
+        while True:
+            now = time.perf_counter()
+            remaining = deadline - now
+            if remaining <= 0:
+                break
+            sleep_time = remaining - self.spin_time
+            if self._tick is not None and remaining > self.tick_guard:
+                if now >= self._next_tick:
+                    self._tick()
+                    self._next_tick = now + self._tick_interval
+                    continue
+                sleep_time = min(sleep_time, self._next_tick - now)
+            if sleep_time > 0:
+                time.sleep(sleep_time)
+        return time.perf_counter()
+
+    def report(self):
+        errors = ", ".join(f"{name} {error * 1000:.2f} ms" for name, error in self.errors.items())
+        return f"Scheduling error: {errors}"
@@ -0,0 +1,154 @@
+import json
+import os
+import time
+
+import numpy as np
+
+from AcquisitionPipeline import AcquisitionPipeline
+from ExperimentLog import print_log
+
+# Calibration result used by the acquisition programs, next to the programs themselves
+CALIBRATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shutter_calibration.json')
+
+
+class FrameRecorder:
+    """Keep a downsampled copy of every frame, used as a writer of an AcquisitionPipeline."""
+
+    def __init__(self, downsample=4):
+        self.downsample = downsample
+        self.frames = []
+        self.timestamps = []
+
+    def write(self, frame, timestamp):
+        if frame.ndim == 3:
+            frame = frame[:, :, 2]  # Using the red channel, as the analysis does
+        self.frames.append(frame[::self.downsample, ::self.downsample].astype(np.float32))
+        self.timestamps.append(timestamp)
+
+    def close(self):
+        pass
+
+
+def calibrate_shutter(grab_frame, shutter, toggles=10, interval=0.5, log=print_log, clock=time.perf_counter,
+                      frame_time=None):
+    """
+    Measure the delay from a shutter command to the light showing up in the frame stream.
+
+    The shutter is toggled toggles times, interval seconds apart, while the camera watches
+    the laser spot or a photodiode. The pixels that change most between shutter open and
+    closed are found automatically and their mean brightness is followed through the
+    frames. The time at which it crosses halfway between the closed and open levels,
+    interpolated between frames, minus the time the toggle command had left the host is
+    the latency of that toggle.
+
+    Frames and toggles must be timed on the clock of the _timestamps_runN.csv and
+    _shutter_runN.csv files of the acquisition program, so the latency is exactly what is
+    needed to line up recorded frames with the shutter events of a run. By default these
+    are arrival times from time.perf_counter(), as the uc480 program records them; the
+    Raspberry Pi program passes the raw camera clock and the PTS of the frames.
+
+    The shutter must be closed when the calibration starts; an odd number of toggles is
+    rounded up so it ends closed as well.
+
+    :param grab_frame: callable returning the next frame from the camera, or None
+    :param shutter: ShutterController of the shutter
+    :param toggles: number of shutter toggles
+    :param interval: seconds between toggles, long enough for the shutter to settle
+    :param clock: callable returning the current time in seconds on the clock of the frame times
+    :param frame_time: callable returning the time of the frame just grabbed, by default its arrival time on clock
+    :return: dict with the mean latency and jitter, the open and close latencies and every single latency
+    """
+    toggles += toggles % 2
+    recorder = FrameRecorder()
+    pipeline = AcquisitionPipeline(grab_frame, [recorder], queue_size=256,
+                                   frame_time=frame_time if frame_time is not None else clock)
+
+    start_time = clock()
+    pipeline.start(start_time)
+    toggle_times = []
+    for i in range(toggles):
+        # The toggle time is measured, so the sleep doesn't need to be precise
+        time.sleep(max(0.0, start_time + (i + 1) * interval - clock()))
+        shutter.toggle()
+        # Stamped once the command has left the host, as the acquisition programs stamp the shutter events
+        toggle_times.append(clock() - start_time)
+        log(f"Calibration toggle {i + 1}/{toggles}")
+    time.sleep(interval)
+    pipeline.stop()
+
+    latencies = estimate_latencies(np.array(recorder.timestamps), np.array(recorder.frames), np.array(toggle_times),
+                                   interval)
+    found = latencies[~np.isnan(latencies)]
+    if len(found) == 0:
+        raise ValueError("No shutter transition was found in the frames")
+    result = {
+        'latency': float(np.mean(found)),
+        'jitter': float(np.std(found)),
+        'open_latency': float(np.nanmean(latencies[0::2])),
+        'close_latency': float(np.nanmean(latencies[1::2])),
+        'toggles': toggles,
+        'transitions_found': int(len(found)),
+        'latencies': [None if np.isnan(latency) else float(latency) for latency in latencies],
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    log(f"Shutter latency {result['latency'] * 1000:.2f} ms, jitter {result['jitter'] * 1000:.2f} ms "
+        f"({len(found)}/{toggles} transitions)")
+    return result
+
+
+def estimate_latencies(timestamps, frames, toggle_times, interval):
+    """
+    Return the latency of every toggle, NaN where no transition was found.
+
+    :param timestamps: frame times in seconds
+    :param frames: array of shape (frames, height, width)
+    :param toggle_times: times of the toggles, the first one opens the shutter
+    :param interval: seconds between toggles
+    """
+    # Frames well inside the closed and open periods
+    closed = timestamps < toggle_times[0]
+    opened = np.zeros(len(timestamps), dtype=bool)
+    for on_time in toggle_times[0::2]:
+        opened |= (timestamps > on_time + interval / 2) & (timestamps < on_time + interval)
+    if not np.any(closed) or not np.any(opened):
+        raise ValueError("Not enough frames were recorded to calibrate the shutter")
+
+    # The spot is made of the pixels that change most when the shutter opens
+    change = np.abs(frames[opened].mean(axis=0) - frames[closed].mean(axis=0))
+    if change.max() < 5:
+        raise ValueError("The shutter doesn't change the image, is the camera looking at the spot?")
+    spot = change >= change.max() / 2
+    brightness = frames[:, spot].mean(axis=1)
+
+    closed_level = np.median(brightness[closed])
+    open_level = np.median(brightness[opened])
+    threshold = (closed_level + open_level) / 2
+    rising = open_level > closed_level
+
+    latencies = np.full(len(toggle_times), np.nan)
+    for i, toggle_time in enumerate(toggle_times):
+        # Even toggles open the shutter, odd ones close it
+        above = brightness > threshold if (i % 2 == 0) == rising else brightness < threshold
+        window = (timestamps > toggle_time) & (timestamps < toggle_time + interval)
+        candidates = np.nonzero(window & above)[0]
+        if len(candidates) == 0 or candidates[0] == 0:
+            continue
+        j = candidates[0]
+        # Interpolate the crossing between the last frame before and the first frame after it
+        fraction = (threshold - brightness[j - 1]) / (brightness[j] - brightness[j - 1])
+        crossing = timestamps[j - 1] + fraction * (timestamps[j] - timestamps[j - 1])
+        latencies[i] = crossing - toggle_time
+    return latencies
+
+
+def save_calibration(result, file_name=CALIBRATION_FILE):
+    with open(file_name, 'w') as f:
+        json.dump(result, f, indent=2)
+
+
+def load_calibration(file_name=CALIBRATION_FILE):
+    """Return the stored calibration result, or None if the shutter hasn't been calibrated."""
+    if not os.path.exists(file_name):
+        return None
+    with open(file_name) as f:
+        return json.load(f)
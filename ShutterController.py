@@ -0,0 +1,61 @@
+import csv
+import time
+
+import serial
+
+
+class ShutterController:
+    """
+    Keep a single serial connection to the PIC10F200 shutter open for a whole session.
+
+    Opening the FTDI port costs tens of milliseconds on Windows, so the port is opened
+    once and reused for every toggle. Each toggle is timed from the write call to the
+    return of flush() and kept in toggle_log as (toggle_time, latency) pairs, where
+    toggle_time is the time.perf_counter() value when the byte had left the host.
+
+    :param port: COM port of the FTDI adapter
+    :param baudrate: baud rate expected by the PIC10F200 firmware
+    :param serial_class: class used to open the port, e.g. a simulated one
+    """
+
+    def __init__(self, port, baudrate=10000, serial_class=serial.Serial):
+        self.port = port
+        self.baudrate = baudrate
+        self.serial_class = serial_class
+        self.ser = None
+        self.toggle_log = []
+
+    def open(self):
+        if self.ser is None or not self.ser.is_open:
+            self.ser = self.serial_class(port=self.port, baudrate=self.baudrate, bytesize=8, timeout=2,
+                                         stopbits=serial.STOPBITS_ONE)
+
+    def toggle(self):
+        self.open()
+        write_time = time.perf_counter()
+        self.ser.write(b'\xFF')
+        self.ser.flush()  # Block until the byte has been handed to the adapter
+        toggle_time = time.perf_counter()
+
+        latency = toggle_time - write_time
+        self.toggle_log.append((toggle_time, latency))
+        return toggle_time, latency
+
+    def close(self):
+        if self.ser is not None and self.ser.is_open:
+            self.ser.close()
+        self.ser = None
+
+
+def write_shutter_events(file_name, events):
+    """
+    Write the shutter events of one run to a CSV file.
+
+    :param file_name: path of the CSV file
+    :param events: list of (event name, time since run start, write latency) tuples
+    """
+    with open(file_name, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['event', 'timestamp', 'latency'])
+        for event, timestamp, latency in events:
+            writer.writerow([event, timestamp, latency])
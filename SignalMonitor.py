@@ -0,0 +1,86 @@
+import csv
+import threading
+
+import numpy as np
+
+
+class SignalMonitor:
+    """
+    Compute a thermal lens signal for every frame while a run is recording.
+
+    The monitor is used like a writer, so the acquisition pipeline feeds it from its own
+    bounded queue and a slow monitor only drops frames, never holds up the camera. Frames
+    of the background phase are averaged into the background incrementally; for every
+    later frame the metric of TotalcounterGUIv1 is computed: the root mean square of the
+    difference to the background, with differences below threshold counted as zero.
+    Frames are downsampled first, which is plenty for deciding whether a run worked.
+
+    :param background_time: seconds from the run start after which the laser is switched on
+    :param laser_time: seconds the laser stays on
+    :param threshold: absolute differences below this are treated as noise
+    :param downsample: keep every n-th row and column
+    """
+
+    def __init__(self, background_time, laser_time, threshold=20, downsample=4):
+        self.background_time = background_time
+        self.laser_time = laser_time
+        self.threshold = threshold
+        self.downsample = downsample
+
+        self.background = None
+        self.background_frames = 0
+        self.timestamps = []
+        self.signals = []
+        self._lock = threading.Lock()
+
+    def _prepare(self, frame):
+        if frame.ndim == 3:
+            frame = frame[:, :, 2]  # Using the red channel, as the analysis does
+        return frame[::self.downsample, ::self.downsample].astype(np.float32)
+
+    def write(self, frame, timestamp):
+        small = self._prepare(frame)
+        if timestamp < self.background_time:
+            # Running mean of the background frames
+            if self.background is None:
+                self.background = np.zeros_like(small)
+            self.background_frames += 1
+            self.background += (small - self.background) / self.background_frames
+            return
+        if self.background is None:
+            return
+
+        diff = small - self.background
+        diff[np.abs(diff) < self.threshold] = 0
+        signal = float(np.sqrt(np.mean(np.square(diff))))
+        with self._lock:
+            self.timestamps.append(float(timestamp))
+            self.signals.append(signal)
+
+    def close(self):
+        pass
+
+    @property
+    def latest(self):
+        with self._lock:
+            return self.signals[-1] if self.signals else None
+
+    def signal(self):
+        """Return the mean signal of the laser phase, None if no laser frame was seen."""
+        with self._lock:
+            timestamps = np.array(self.timestamps)
+            signals = np.array(self.signals)
+        laser_on = timestamps < self.background_time + self.laser_time
+        if not np.any(laser_on):
+            return None
+        return float(np.mean(signals[laser_on]))
+
+    def write_csv(self, file_name):
+        with self._lock:
+            rows = list(zip(self.timestamps, self.signals))
+        with open(file_name, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['frame', 'timestamp', 'phase', 'signal'])
+            for i, (timestamp, signal) in enumerate(rows):
+                phase = 'laser' if timestamp < self.background_time + self.laser_time else 'recovery'
+                writer.writerow([i, timestamp, phase, signal])
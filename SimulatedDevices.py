@@ -0,0 +1,337 @@
+import threading
+import time
+
+import numpy as np
+
+
+class SimulatedLaser:
+    """
+    Shared state between the simulated shutter and the simulated cameras.
+
+    Each toggle switches the laser after shutter_latency seconds. The thermal lens
+    builds up with time constant rise_time while the laser is on and relaxes with
+    decay_time once it is off.
+    """
+
+    def __init__(self, shutter_latency=0.005, rise_time=0.5, decay_time=0.8):
+        self.shutter_latency = shutter_latency
+        self.rise_time = rise_time
+        self.decay_time = decay_time
+        self.toggle_times = []
+        self._lock = threading.Lock()
+
+    def toggle(self, command_time):
+        with self._lock:
+            self.toggle_times.append(command_time + self.shutter_latency)
+
+    def on_fraction(self, start, end):
+        # Fraction of the interval [start, end] during which the laser was on
+        with self._lock:
+            toggles = list(self.toggle_times)
+        on_time = 0.0
+        for i in range(0, len(toggles), 2):
+            on = toggles[i]
+            off = toggles[i + 1] if i + 1 < len(toggles) else end
+            on_time += max(0.0, min(off, end) - max(on, start))
+        return on_time / (end - start) if end > start else float(self.is_on(end))
+
+    def is_on(self, t):
+        with self._lock:
+            return sum(1 for toggle in self.toggle_times if toggle <= t) % 2 == 1
+
+    def lens_amplitude(self, t):
+        # Relative strength (0-1) of the thermal lens at time t
+        with self._lock:
+            toggles = [toggle for toggle in self.toggle_times if toggle <= t]
+        amplitude = 0.0
+        previous = None
+        for i, toggle in enumerate(toggles + [t]):
+            if previous is not None:
+                dt = toggle - previous
+                if i % 2 == 1:
+                    amplitude = 1.0 - (1.0 - amplitude) * np.exp(-dt / self.rise_time)
+                else:
+                    amplitude *= np.exp(-dt / self.decay_time)
+            previous = toggle
+        return amplitude
+
+
+class SyntheticScene:
+    """
+    Render greyscale thermal lens frames quickly from a set of pre-rendered lens levels.
+
+    A probe beam profile is distorted by a plume below the beam whose strength follows
+    the simulated laser. A small spot in the top-left corner lights up while the laser
+    is on, weighted by the fraction of the exposure the laser was on, which is what the
+    shutter calibration looks at.
+    """
+
+    def __init__(self, resolution, laser=None, levels=16, seed=0):
+        width, height = resolution
+        self.laser = laser if laser is not None else SimulatedLaser()
+        self.levels = levels
+        rng = np.random.default_rng(seed)
+
+        y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+        cx, cy = width / 2, height / 2
+        beam = 180 * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2 * (0.25 * min(width, height)) ** 2))
+        plume = np.exp(-((x - cx) ** 2 / (2 * (0.08 * width) ** 2) + (y - 0.7 * height) ** 2 / (2 * (0.12 * height) ** 2)))
+
+        self.frames = []
+        for level in range(levels):
+            amplitude = level / (levels - 1)
+            frame = beam * (1 - 0.6 * amplitude * plume) + 20 + rng.normal(0, 2, size=beam.shape)
+            self.frames.append(np.clip(frame, 0, 255).astype(np.uint8))
+
+        self.spot = (slice(8, 8 + max(4, height // 32)), slice(8, 8 + max(4, width // 32)))
+
+    def render(self, t, exposure, roi=None):
+        level = int(round(self.laser.lens_amplitude(t) * (self.levels - 1)))
+        frame = self.frames[level].copy()
+        frame[self.spot] = int(20 + 230 * self.laser.on_fraction(t - exposure, t))
+        if roi is not None:
+            hstart, hend, vstart, vend = roi
+            frame = np.ascontiguousarray(frame[vstart:vend, hstart:hend])
+        return frame
+
+
+class SimulatedCameraTimeoutError(Exception):
+    pass
+
+
+class SimulatedUC480Camera:
+    """
+    Stand-in for pylablib's uc480.UC480Camera, free-running at the set frame period.
+
+    Frames become available on a fixed clock and are kept in a ring of buffer_frames
+    frames like the camera driver does; a reader that falls further behind loses the
+    oldest frames. As on the real sensor, reading out fewer rows of an area of interest
+    raises the fastest frame rate.
+
+    :param resolution: (width, height) of the sensor
+    :param max_fps: fastest frame rate the simulated sensor supports at full resolution
+    :param laser: SimulatedLaser shared with the simulated shutter
+    """
+
+    TimeoutError = SimulatedCameraTimeoutError
+
+    def __init__(self, resolution=(1280, 1024), max_fps=60.0, laser=None, buffer_frames=100):
+        self.resolution = resolution
+        self.max_fps = max_fps
+        self.buffer_frames = buffer_frames
+        self.scene = SyntheticScene(resolution, laser)
+        self.roi = (0, resolution[0], 0, resolution[1])
+        self.exposure = 100e-6
+        self.frame_period = 1.0 / max_fps
+        self._acquisition_start = None
+        self._next_frame = 0
+
+    def set_exposure(self, exposure):
+        # The exposure is clamped to the frame period when frames are rendered
+        self.exposure = exposure
+        return self.exposure
+
+    def set_gains(self, master, red=None, green=None, blue=None):
+        return master
+
+    def get_detector_size(self):
+        return self.resolution
+
+    def set_roi(self, hstart=0, hend=None, vstart=0, vend=None, hbin=1, vbin=1):
+        # Like the uc480 sensors, the area starts and ends on multiples of 4 columns and 2 rows
+        width, height = self.resolution
+        hend = width if hend is None else hend
+        vend = height if vend is None else vend
+        hstart = min(max(0, hstart // 4 * 4), width - 32)
+        vstart = min(max(0, vstart // 2 * 2), height - 4)
+        hend = max(hstart + 32, min(width, (hend + 3) // 4 * 4))
+        vend = max(vstart + 4, min(height, (vend + 1) // 2 * 2))
+        self.roi = (hstart, hend, vstart, vend)
+        return self.get_roi()
+
+    def get_roi(self):
+        return self.roi + (1, 1)
+
+    def set_frame_period(self, frame_period):
+        rows = self.roi[3] - self.roi[2]
+        self.frame_period = max(frame_period, rows / (self.resolution[1] * self.max_fps))
+        return self.frame_period
+
+    def start_acquisition(self, *args, **kwargs):
+        self._acquisition_start = time.perf_counter()
+        self._next_frame = 0
+
+    def stop_acquisition(self):
+        self._acquisition_start = None
+
+    def acquisition_in_progress(self):
+        return self._acquisition_start is not None
+
+    def _frame_time(self, index):
+        return self._acquisition_start + (index + 1) * self.frame_period
+
+    def wait_for_frame(self, since="lastread", nframes=1, timeout=20.0):
+        deadline = time.perf_counter() + timeout
+        frame_time = self._frame_time(self._next_frame + nframes - 1)
+        if frame_time > deadline:
+            time.sleep(max(0.0, deadline - time.perf_counter()))
+            raise self.TimeoutError("Timed out waiting for a frame")
+        time.sleep(max(0.0, frame_time - time.perf_counter()))
+
+    def read_oldest_image(self, peek=False, return_info=False):
+        now = time.perf_counter()
+        acquired = int((now - self._acquisition_start) / self.frame_period)
+        if self._next_frame >= acquired:
+            return None
+        # Frames older than the driver buffer have been overwritten
+        self._next_frame = max(self._next_frame, acquired - self.buffer_frames)
+        index = self._next_frame
+        frame = self.scene.render(self._frame_time(index), min(self.exposure, self.frame_period), self.roi)
+        if not peek:
+            self._next_frame += 1
+        return (frame, index) if return_info else frame
+
+    def close(self):
+        self.stop_acquisition()
+
+
+class SimulatedSerial:
+    """Stand-in for serial.Serial that switches a SimulatedLaser and records every toggle."""
+
+    def __init__(self, port=None, baudrate=10000, laser=None, **kwargs):
+        self.port = port
+        self.baudrate = baudrate
+        self.laser = laser if laser is not None else SimulatedLaser()
+        self.is_open = True
+        self.toggle_times = []
+
+    def write(self, data):
+        now = time.perf_counter()
+        for _ in data:
+            self.toggle_times.append(now)
+            self.laser.toggle(now)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+class SimulatedPiFrame:
+    def __init__(self, index, timestamp, complete=True):
+        self.index = index
+        self.timestamp = timestamp
+        self.complete = complete
+
+
+class SimulatedPiRGBArray:
+    """Stand-in for picamera.array.PiRGBArray."""
+
+    def __init__(self, camera, size=None):
+        self.camera = camera
+        self.array = None
+
+    def truncate(self, size=None):
+        self.array = None
+
+
+class SimulatedPiCamera:
+    """
+    Stand-in for picamera.PiCamera covering recording, splitting and video-port capture.
+
+    Recording runs an encoder thread that writes a dummy payload of about 1/50 of the raw
+    frame size to the output for every frame, or the padded RGB frame when recording in
+    'rgb' format, and sets camera.frame, with timestamps in
+    microseconds. As with picamera, these count from the start of the recording unless
+    clock_mode is 'raw', in which case they are on the same clock as camera.timestamp.
+    """
+
+    def __init__(self, laser=None, clock_mode='reset'):
+        self.laser = laser if laser is not None else SimulatedLaser()
+        self.clock_mode = clock_mode
+        self.resolution = (720, 720)
+        self.framerate = 90
+        self.exposure_mode = 'auto'
+        self.shutter_speed = 7500
+        self.frame = None
+        self.closed = False
+        self._scene = None
+        self._output = None
+        self._next_output = None
+        self._recording = False
+        self._format = None
+        self._encoder_thread = None
+
+    @property
+    def timestamp(self):
+        return int(time.perf_counter() * 1e6)
+
+    def _get_scene(self):
+        if self._scene is None or self._scene.frames[0].shape != tuple(self.resolution)[::-1]:
+            self._scene = SyntheticScene(self.resolution, self.laser)
+        return self._scene
+
+    def _render_rgb(self, t):
+        grey = self._get_scene().render(t, self.shutter_speed / 1e6)
+        rgb = np.zeros(grey.shape + (3,), dtype=np.uint8)
+        rgb[:, :, 0] = grey  # The analysis uses the red channel
+        return rgb
+
+    def start_recording(self, output, format=None, **options):
+        self._output = output
+        self._format = format
+        self._recording = True
+        self._encoder_thread = threading.Thread(target=self._encode_loop, daemon=True)
+        self._encoder_thread.start()
+
+    def split_recording(self, output, **options):
+        self._next_output = output
+        while self._next_output is not None and self._recording:
+            time.sleep(0.001)
+
+    def stop_recording(self):
+        self._recording = False
+        if self._encoder_thread is not None:
+            self._encoder_thread.join()
+            self._encoder_thread = None
+        if hasattr(self._output, 'flush'):
+            self._output.flush()
+
+    def _encode_loop(self):
+        period = 1.0 / float(self.framerate)
+        width, height = self.resolution
+        payload = bytes(width * height * 3 // 50)
+        index = 0
+        clock_origin = 0 if self.clock_mode == 'raw' else self.timestamp
+        next_time = time.perf_counter() + period
+        while self._recording:
+            time.sleep(max(0.0, next_time - time.perf_counter()))
+            next_time += period
+            if self._next_output is not None:
+                self._output, self._next_output = self._next_output, None
+            self.frame = SimulatedPiFrame(index, self.timestamp - clock_origin)
+            if self._format == 'rgb':
+                # Rows padded to 32 pixels and frames to 16 rows, as the camera delivers them
+                rgb = self._render_rgb(time.perf_counter())
+                padded = np.zeros(((height + 15) // 16 * 16, (width + 31) // 32 * 32, 3), dtype=np.uint8)
+                padded[:height, :width] = rgb
+                payload = padded.tobytes()
+            self._output.write(payload)
+            index += 1
+
+    def capture_continuous(self, output, format='rgb', use_video_port=False, **options):
+        period = 1.0 / float(self.framerate)
+        next_time = time.perf_counter() + period
+        while not self.closed:
+            time.sleep(max(0.0, next_time - time.perf_counter()))
+            next_time += period
+            rgb = self._render_rgb(time.perf_counter())
+            output.array = rgb if format == 'rgb' else rgb[:, :, ::-1]
+            yield output
+
+    def close(self):
+        if self._recording:
+            self.stop_recording()
+        self.closed = True
@@ -1,4 +1,3 @@
-import threading
 import tkinter as tk
 from tkinter import ttk
 from tkinter import filedialog
@@ -7,11 +6,28 @@ import serial.tools.list_ports
 import time
 from time import sleep
 import csv
-from PIL import Image
-from PIL import ImageTk
-from picamera import PiCamera
-from picamera.array import PiRGBArray
-
+import sys
+import functools
+from ShutterController import ShutterController, write_shutter_events
+from RunScheduler import RunScheduler
+from PiVideoOutput import DiscardVideoOutput, TimestampedFrameOutput, TimestampedVideoOutput
+from LiveView import LiveView
+from ExperimentLog import ExperimentLog
+from ExperimentWorker import ExperimentWorker
+from ShutterCalibration import calibrate_shutter, load_calibration, save_calibration
+
+# With --simulate a synthetic camera and shutter replace the hardware
+SIMULATE = "--simulate" in sys.argv
+if SIMULATE:
+    from SimulatedDevices import SimulatedLaser, SimulatedPiCamera, SimulatedPiRGBArray, SimulatedSerial
+    simulated_laser = SimulatedLaser()
+    PiCamera = functools.partial(SimulatedPiCamera, laser=simulated_laser)
+    PiRGBArray = SimulatedPiRGBArray
+    serial_class = functools.partial(SimulatedSerial, laser=simulated_laser)
+else:
+    from picamera import PiCamera
+    from picamera.array import PiRGBArray
+    serial_class = serial.Serial
 
 
 class Application(tk.Frame):
@@ -19,6 +35,10 @@ class Application(tk.Frame):
         super().__init__(master)
         self.master = master
         self.pack()
+
+        # Experiments and calibrations run on a worker thread that only logs to this queue
+        self.experiment_log = ExperimentLog()
+
         self.create_widgets()
         self.master.protocol("WM_DELETE_WINDOW", self.on_closing)
                # Create a label to display the video frames
@@ -30,6 +50,14 @@ class Application(tk.Frame):
         
         self.new_window = None  
 
+        # The shutter port is opened on first use and kept open for the session
+        self.shutter = None
+
+        # The shutter is a toggle, so it must not be clicked while a run or calibration uses it
+        self.worker = ExperimentWorker(self, self.console_text, self.experiment_log,
+                                       (self.run_experiment_button, self.calibrate_shutter_button,
+                                        self.live_camera_button, self.toggle_shutter_button))
+
         #self.new_window_open = True
         #self.new_window.protocol("WM_DELETE_WINDOW", self.on_closing)
         
@@ -83,8 +111,8 @@ class Application(tk.Frame):
         tk.Label(setup_frame, text="System Recovery Time").grid(row=3, column=0)
         tk.Entry(setup_frame, textvariable=self.recovery_time_var).grid(row=3, column=1)
         
-        # Sleep Time
-        self.sleep_time_var = tk.StringVar(value='4')
+        # Sleep Time, extra time for the sample between runs; the camera stays open and needs none
+        self.sleep_time_var = tk.StringVar(value='0')
         tk.Label(setup_frame, text="Sleep Time").grid(row=4, column=0)
         tk.Entry(setup_frame, textvariable=self.sleep_time_var).grid(row=4, column=1)
 
@@ -125,6 +153,9 @@ class Application(tk.Frame):
         self.live_camera_button = tk.Button(self, text="Live Camera", command=self.live_camera)
         self.live_camera_button.pack(fill="x", padx=10, pady=5)
 
+        self.calibrate_shutter_button = tk.Button(self, text="Calibrate Shutter", command=self.calibrate_shutter)
+        self.calibrate_shutter_button.pack(fill="x", padx=10, pady=5)
+
 
 
 
@@ -132,10 +163,12 @@ class Application(tk.Frame):
         self.run_experiment_button.pack(fill="x", padx=10, pady=5)
 
 
-        self.quit_button = tk.Button(self, text="QUIT", command=self.master.destroy)
+        self.quit_button = tk.Button(self, text="QUIT", command=self.on_closing)
         self.quit_button.pack(fill="x", padx=10, pady=5)
 
     def get_com_ports(self):
+        if SIMULATE:
+            return ['SIM']
         ports = serial.tools.list_ports.comports()
         return [port.device for port in ports]
 
@@ -155,151 +188,225 @@ class Application(tk.Frame):
             return True
 
 
+    def get_shutter(self):
+        # Reuse the open connection unless a different COM port has been selected
+        if self.shutter is None or self.shutter.port != self.com_port.get():
+            if self.shutter is not None:
+                self.shutter.close()
+            self.shutter = ShutterController(self.com_port.get(), serial_class=serial_class)
+        return self.shutter
+
     def toggle_shutter(self):
         if self.valid_com_port():
-            ser = serial.Serial(port=self.com_port.get(), baudrate=10000, bytesize=8, timeout=2, stopbits=serial.STOPBITS_ONE)
-            ser.write(b'\xFF')
-            self.update_console("Laser/Shutter toggled")
+            toggle_time, latency = self.get_shutter().toggle()
+            self.update_console(f"Laser/Shutter toggled ({latency * 1000:.2f} ms)")
+            return toggle_time, latency
         
     
     def live_camera(self):
         if self.valid_com_port():
             self.live_view_running = not self.live_view_running  # toggle live view state
             if self.live_view_running:
-                # Start live view
-                self.camera = PiCamera()
-                self.camera.resolution = (320, 240)
-                self.camera.framerate = 60
-                self.camera.exposure_mode = 'off'  # Turn off automatic exposure mode
-                self.camera.shutter_speed = 7500
-
-                self.rawCapture = PiRGBArray(self.camera)  # Create an array for the captured frames
+                self.open_frame_stream()
                 # Create a new window
                 self.new_window = tk.Toplevel(self.master)
                 self.new_window.title("Live Camera Feed")
-                self.new_window.geometry("320x240")  # Set the size of the window
+                self.new_window.geometry("380x380")  # Set the size of the window
                 self.new_window.configure(bg='black')
                 # Create a label for the video feed
                 self.video_label = tk.Label(self.new_window)
                 self.video_label.pack(padx=10, pady=10)
                 self.new_window.protocol("WM_DELETE_WINDOW", self.close_live_view)  # Define what happens when the window is closed
-                threading.Thread(target=self.update_frame).start()  # Start updating the frame in the new window in a new thread
+                # Frames are grabbed and halved on a worker thread, Tk shows the newest one at up to 25 fps
+                self.live_view = LiveView(self.video_label, self.grab_live_frame, downsample=2, max_display_fps=25)
+                self.live_view.start()
             else:
                 # Stop live view
                 self.close_live_view()
 
+    def open_frame_stream(self):
+        # Same field of view and frame rate as the experiment
+        # Raw clock, so frame timestamps are on the same clock as camera.timestamp
+        self.camera = PiCamera(clock_mode='raw')
+        self.camera.resolution = (720, 720)
+        self.camera.framerate = 90
+        self.camera.exposure_mode = 'off'  # Turn off automatic exposure mode
+        self.camera.shutter_speed = 7500
+
+        # Capture continuously from the video port instead of taking single stills
+        self.rawCapture = PiRGBArray(self.camera)  # Create an array for the captured frames
+        self.frame_stream = self.camera.capture_continuous(self.rawCapture, format="rgb", use_video_port=True)
+
+    def calibrate_shutter(self):
+        if self.valid_com_port():
+            # The camera has to look at the laser spot or a photodiode with the shutter closed
+            if self.live_view_running:
+                self.close_live_view()
+            shutter = self.get_shutter()
+            log = self.experiment_log.log
+
+            def calibrate():
+                log("Calibrating shutter latency...", "green")
+                # The runs are timed by the frame PTS and the shutter toggles by camera.timestamp, both on
+                # the raw camera clock, so the calibration records its frames to get their PTS as well
+                camera = PiCamera(clock_mode='raw')
+                camera.resolution = (720, 720)
+                camera.framerate = 90
+                camera.exposure_mode = 'off'  # Turn off automatic exposure mode
+                camera.shutter_speed = 7500
+                output = TimestampedFrameOutput(camera)
+                camera.start_recording(output, format='rgb')
+
+                def grab_frame():
+                    # The calibration follows the red channel of BGR frames
+                    frame = output.grab()
+                    return frame[:, :, ::-1] if frame is not None else None
+
+                try:
+                    result = calibrate_shutter(grab_frame, shutter, log=log, clock=lambda: camera.timestamp / 1e6,
+                                               frame_time=lambda: output.timestamp / 1e6)
+                except ValueError as e:
+                    log(f"Calibration failed: {e}", "red")
+                    return
+                finally:
+                    camera.stop_recording()
+                    camera.close()
+                save_calibration(result)
+                log("Shutter calibration saved, it is stored in the info file of every experiment", "blue")
+
+            self.worker.run(calibrate)
+
     def close_live_view(self):
         # Function to close live view
         self.live_view_running = False
+        self.live_view.stop()
+        self.frame_stream.close()
         self.camera.close()
         self.new_window.destroy()
 
     def on_closing(self):
         # Check if the live view is running
         if self.live_view_running:
-            self.live_view_running = False
-            self.camera.close()
-            self.new_window.destroy()
+            self.close_live_view()
+        if self.shutter is not None:
+            self.shutter.close()
         self.master.destroy()
 
     #def on_closing(self):
     #    self.new_window_open = False
     #    self.new_window.destroy()
 
-    def update_frame(self):
-        while self.live_view_running and self.new_window:
-            # Capture frame
-            self.camera.capture(self.rawCapture, format="bgr")
-            frame = self.rawCapture.array
-            # Convert the image from OpenCV BGR format to Tkinter PhotoImage format
-            img = Image.fromarray(frame)
-            imgtk = ImageTk.PhotoImage(image=img)
-            self.video_label.imgtk = imgtk
-            self.video_label.configure(image=imgtk)
-            self.rawCapture.truncate(0)  # clear the stream in preparation for the next frame
-            sleep(0.01)  # Pause for a bit before capturing the next frame
+    def grab_live_frame(self):
+        # Runs on the live view thread
+        self.rawCapture.truncate(0)  # clear the stream in preparation for the next frame
+        return next(self.frame_stream).array
             
     def run_experiment(self):
         if self.valid_com_port():
+            # The live view holds the camera, release it before recording
+            if self.live_view_running:
+                self.close_live_view()
+
             num_runs = int(self.num_runs_var.get())
             experiment_info = self.info_text.get('1.0', tk.END)
+            file_name = self.file_name_var.get()
 
             # File to store the user's input and parameters
-            with open(self.file_name_var.get() + '_info.txt', 'w') as f:
+            with open(file_name + '_info.txt', 'w') as f:
                 f.write('Experiment Information:\n' + experiment_info)
                 f.write('\nExperiment Parameters:\n')
+                # Kept above the phase times, the analysis reads those from the last three lines
+                calibration = load_calibration()
+                if calibration is not None:
+                    f.write('Shutter Latency: ' + str(calibration['latency']) + '\n')
                 f.write('Number of Runs: ' + self.num_runs_var.get() + '\n')
                 f.write('Background Collection Time: ' + self.bg_time_var.get() + '\n')
                 f.write('Laser On Time: ' + self.laser_time_var.get() + '\n')
                 f.write('System Recovery Time: ' + self.recovery_time_var.get() + '\n')
                
 
+            # Event deadlines are computed once for all runs
+            scheduler = RunScheduler(float(self.bg_time_var.get()), float(self.laser_time_var.get()),
+                                     float(self.recovery_time_var.get()))
+
+            # The form is read here, the runs are recorded on a worker thread that doesn't touch Tk
+            run_runs = functools.partial(self.record_runs, file_name, num_runs, scheduler, self.get_shutter(),
+                                         float(self.sleep_time_var.get()))
+            self.worker.run(run_runs, log_file=file_name + '_log.csv')
+
+    def record_runs(self, file_name, num_runs, scheduler, shutter, sleep_time):
+        log = self.experiment_log.log
+
+        # The camera is opened once and keeps recording for the whole experiment; between runs
+        # the encoder output goes to a discard output, so the sensor and encoder stay warm
+        # In the default clock mode frame timestamps start at zero with the recording, while
+        # camera.timestamp counts from boot; the raw clock puts both on the same time axis
+        camera = PiCamera(clock_mode='raw')
+        camera.resolution = (720, 720)
+        camera.framerate = 90
+        camera.exposure_mode = 'off'  # Turn off automatic exposure mode
+        camera.shutter_speed = 7500
+        discard = DiscardVideoOutput()
+        # Splits happen on key frames, a short intra period keeps the wait for one short
+        camera.start_recording(discard, format='h264', intra_period=30, inline_headers=True)  # Using h264 codec
+
+        try:
             for run in range(num_runs):
-                # Open the camera
-                camera = PiCamera()
-                camera.resolution = (720, 720)
-                camera.framerate = 90
-                camera.exposure_mode = 'off'  # Turn off automatic exposure mode
-                camera.shutter_speed = 7500
-
-                self.console_text.insert(tk.END, f"Beginning run {run + 1}\n","green")
-                self.update()
-
-                # Begin recording
-                camera.start_recording(self.file_name_var.get() + str(run) + '.h264')  # Using h264 codec
-
-                start_time = time.time()  # To get the start time
-                toggle_count = 0
-
-                while True:
-                    current_time = time.time()
-
-                    if current_time - start_time > float(self.bg_time_var.get()) and toggle_count == 0:
-                        toggle_count += 1
-                        self.toggle_shutter()
-                        self.console_text.insert(tk.END, "Laser on sample now\n")
-                        self.console_text.see(tk.END)
-                        self.update()
-
-                    if current_time - start_time > float(self.laser_time_var.get())+float(self.bg_time_var.get()) and toggle_count == 1:
-                        toggle_count += 1
-                        self.toggle_shutter()
-                        self.console_text.insert(tk.END, "Resting phase\n")
-                        self.console_text.see(tk.END)
-                        self.update()
-
-                    if current_time - start_time > float(self.recovery_time_var.get())+ float(self.laser_time_var.get())+float(self.bg_time_var.get()) and toggle_count == 2:
-                        self.console_text.insert(tk.END, f"Run {run + 1} is complete.\n","red")
-                        self.console_text.see(tk.END)
-                        self.update()
-                        end_time = time.time()
-                        break  # End the current run
-
-                # Stop recording
-                camera.stop_recording()
-
-                # Close the camera
-                camera.close()
-
-                self.console_text.insert(tk.END, f"Writing video file for run {run + 1}\n")
-                self.console_text.see(tk.END)
-                self.update()
-
-                # Time for the camera to reset
-                sleep(float(self.sleep_time_var.get()))
-
-            self.console_text.insert(tk.END,"Experiment finished.\n","blue")
-            self.console_text.see(tk.END)
-            self.update()
+                log(f"Beginning run {run + 1}", "green")
+
+                # Start this run's file on the next key frame, keeping the presentation timestamp of every frame
+                output = TimestampedVideoOutput(camera, file_name + str(run) + '.h264')
+                camera.split_recording(output)
+
+                start_time = time.perf_counter()  # To get the start time
+                recording_start = camera.timestamp
+                camera_events = []
+
+                # Shutter toggles are stamped on the camera clock so they line up with the frame PTS
+                def toggle(event, message):
+                    toggle_time, latency = shutter.toggle()
+                    camera_events.append((event, camera.timestamp, latency))
+                    log(f"Laser/Shutter toggled ({latency * 1000:.2f} ms)")
+                    log(message)
+
+                # Sleep between events so the encoder has the CPU to itself
+                scheduler.run(start_time, {
+                    'laser_on': lambda: toggle('laser_on', "Laser on sample now"),
+                    'laser_off': lambda: toggle('laser_off', "Resting phase"),
+                    'run_end': lambda: log(f"Run {run + 1} is complete.", "red"),
+                })
+
+                # End this run's file, the encoder goes on writing into the discard output
+                camera.split_recording(discard)
+                output.close()
+
+                # Frame and shutter times in seconds since the first recorded frame
+                origin = output.start_pts if output.start_pts is not None else recording_start
+                shutter_events = [(event, (camera_time - origin) / 1e6, latency)
+                                  for event, camera_time, latency in camera_events]
+                output.write_timestamps(file_name + '_timestamps_run' + str(run) + '.csv')
+                write_shutter_events(file_name + '_shutter_run' + str(run) + '.csv', shutter_events)
+
+                log(f"Writing video file for run {run + 1}")
+                log(scheduler.report())
+
+                # Optional extra time for the sample to recover, the camera doesn't need any
+                if sleep_time > 0 and run < num_runs - 1:
+                    sleep(sleep_time)
+        finally:
+            camera.stop_recording()
+            camera.close()
+
+        log("Experiment finished.", "blue")
 
 
   #  def video_viewer(self):
         # This method should handle Open Video Viewer functionality
    #     pass
     
-    def update_console(self, text):
-        self.console_text.insert(tk.END, text + "\n")
-        self.console_text.see(tk.END)  # Scroll the Text widget to the bottom
+    def update_console(self, text, tag=None):
+        # Shown by the worker's poll, so this is safe to call from any thread
+        self.experiment_log.log(text, tag)
 
 def main():
     root = tk.Tk()
@@ -0,0 +1,85 @@
+import json
+import os
+
+# Kept in the data folder next to the files it describes
+MANIFEST_NAME = 'analysis_manifest.json'
+
+
+def signature(file_name):
+    # Size and modification time identify a version of a file, as in the frame cache
+    stat = os.stat(file_name)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class AnalysisManifest:
+    """
+    Remember how the outputs of the analysis stages of a data folder were made, so only stale steps run again.
+
+    A step is one run of a stage, e.g. the conversion of one .h264 file, identified by the
+    stage and its output files. After a step has run, record() stores the signatures of its
+    inputs and outputs together with the parameters it used. The step is stale when it has
+    never run, its parameters changed, an input or output is missing or changed since, or
+    the set of inputs is different.
+
+    The outputs of one stage are the inputs of the next, so a step that runs again makes the
+    steps that depend on it stale, while changing e.g. the wavefront threshold only makes the
+    wavefront steps stale. Delete the manifest to run everything again.
+
+        manifest = AnalysisManifest(directory)
+        if manifest.stale('timecal', [flipped_file, info_file], {}, [timecal_file]):
+            ...
+            manifest.record('timecal', [flipped_file, info_file], {}, [timecal_file])
+
+    :param directory: data folder; paths are stored relative to it, so the folder can be moved
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_file = os.path.join(directory, MANIFEST_NAME)
+        self.steps = {}
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file) as f:
+                self.steps = json.load(f)
+
+    def _relative(self, file_name):
+        return os.path.relpath(file_name, self.directory).replace(os.sep, '/')
+
+    def _key(self, stage, outputs):
+        return f"{stage}:{','.join(self._relative(output) for output in outputs)}"
+
+    def _stored(self, parameters):
+        # Parameters as they come back from the manifest, e.g. tuples as lists, so recorded and new ones compare equal
+        return json.loads(json.dumps(parameters))
+
+    def _signatures(self, file_names):
+        return {self._relative(file_name): signature(file_name) for file_name in file_names}
+
+    def stale(self, stage, inputs, parameters, outputs):
+        step = self.steps.get(self._key(stage, outputs))
+        if step is None:
+            return True
+
+        if step['parameters'] != self._stored(parameters):
+            return True
+
+        try:
+            return (step['inputs'] != self._signatures(inputs) or
+                    step['outputs'] != self._signatures(outputs))
+        except FileNotFoundError:
+            return True
+
+    def record(self, stage, inputs, parameters, outputs):
+        self.steps[self._key(stage, outputs)] = {
+            'stage': stage,
+            'inputs': self._signatures(inputs),
+            'parameters': self._stored(parameters),
+            'outputs': self._signatures(outputs),
+        }
+        self.save()
+
+    def save(self):
+        # Written under a temporary name, so an interrupted save never leaves half a manifest
+        temporary_file = f"{self.manifest_file}.{os.getpid()}.tmp"
+        with open(temporary_file, 'w') as f:
+            json.dump(self.steps, f, indent=1)
+        os.replace(temporary_file, self.manifest_file)
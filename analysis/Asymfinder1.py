@@ -1,41 +1,29 @@
-import cv2
 import numpy as np
 import glob
 import csv
 import os
 
-def integrate_video_frames(video_path, start_frame, end_frame):
-    # Open the video file
-    cap = cv2.VideoCapture(video_path)
+from FrameCache import FrameCache
 
-    if not cap.isOpened():
+def integrate_video_frames(video_path, start_frame, end_frame):
+    # Open the decoded video, it is only decoded again if it has changed since the last analysis
+    try:
+        source = FrameCache().open(video_path, start=start_frame, stop=end_frame)
+    except IOError:
         print(f"Error: Could not open video {video_path}.")
         return None
 
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-
-    # Check if the frame range is valid
-    if start_frame < 0 or end_frame >= frame_count or start_frame >= end_frame:
-        print(f"Invalid frame range for integration in video {video_path}.")
-        return None
-
-    # Initialize a matrix to hold the averaged data
-    heatmap_data = np.zeros((frame_height, frame_count))
-
-    for i in range(frame_count):
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        avg_intensity = np.mean(frame_gray, axis=1)
-        heatmap_data[:, i] = avg_intensity
+    with source:
+        # Check if the frame range is valid
+        if start_frame < 0 or end_frame >= source.total_frames or start_frame >= end_frame:
+            print(f"Invalid frame range for integration in video {video_path}.")
+            return None
 
-    cap.release()
+        # Integrate the row averages over the specified frame range
+        integrated_data = np.zeros(source.height)
+        for batch in source.batches():
+            integrated_data += np.mean(batch, axis=2).sum(axis=0)
 
-    # Integrate the data over the specified frame range
-    integrated_data = np.sum(heatmap_data[:, start_frame:end_frame], axis=1)
     return integrated_data
 
 # Ask the user for the directory
@@ -0,0 +1,94 @@
+from collections import deque
+
+import numpy as np
+
+MODELS = ('mean', 'median', 'exponential', 'rolling')
+
+
+class BackgroundModel:
+    """
+    Reference frame that is subtracted from the frames of a run.
+
+    The first frames of a run are fed to update() until the model is ready; after that
+    reference is the background to subtract. Frames fed after that only change the
+    reference of the moving models:
+
+    - mean: mean of the first frames, computed once
+    - median: median of the first frames, computed once, ignores spikes in the background
+    - exponential: starts as the mean, then follows every frame with weight alpha, for slow drifts
+    - rolling: mean of the last frames fed, for differences to the recent past
+
+    The reference is kept up to date incrementally, so getting it costs nothing per frame.
+
+    :param frames: number of frames that make up the background
+    :param model: one of MODELS
+    :param alpha: weight of a new frame in the exponential model, by default 2 / (frames + 1)
+    """
+
+    def __init__(self, frames=120, model='mean', alpha=None):
+        if model not in MODELS:
+            raise ValueError(f"Unknown background model {model}")
+        if frames < 1:
+            raise ValueError("The background needs at least one frame")
+        self.frames = frames
+        self.model = model
+        self.alpha = alpha if alpha is not None else 2 / (frames + 1)
+
+        self.count = 0
+        self.reference = None
+        self._sum = None
+        self._stack = None
+        self._window = deque()
+
+    @property
+    def ready(self):
+        return self.count >= self.frames
+
+    def update(self, frame):
+        if not self.ready:
+            self._collect(frame)
+        elif self.model == 'exponential':
+            self.reference += self.alpha * (frame - self.reference)
+        elif self.model == 'rolling':
+            self._sum += frame
+            self._window.append(frame)
+            self._sum -= self._window.popleft()
+            self.reference = self._sum / self.frames
+
+    def _collect(self, frame):
+        if self.model == 'median':
+            if self._stack is None:
+                self._stack = np.empty((self.frames,) + frame.shape, dtype=frame.dtype)
+            self._stack[self.count] = frame
+        else:
+            # Sums of integer frames are exact in float64, so the mean doesn't depend on the order
+            if self._sum is None:
+                self._sum = np.zeros(frame.shape, dtype=np.float64)
+            self._sum += frame
+            if self.model == 'rolling':
+                self._window.append(frame)
+        self.count += 1
+
+        if self.ready:
+            if self.model == 'median':
+                self.reference = np.median(self._stack, axis=0)
+                self._stack = None
+            else:
+                self.reference = self._sum / self.frames
+
+
+def subtract_background(source, frame_num, background_model):
+    # Yield every frame with its absolute difference to the background, None for the background frames.
+    # The background is built from scratch, so a second pass over the source yields the same differences
+    background = BackgroundModel(frame_num, background_model)
+    for frame_grey in source:
+        if not background.ready:
+            background.update(frame_grey)
+            yield frame_grey, None
+            continue
+
+        subtract_frame = np.abs(frame_grey.astype(np.int32) - background.reference.astype(np.int32))
+        yield frame_grey, subtract_frame
+
+        # Only changes the background of the moving models
+        background.update(frame_grey)
@@ -5,8 +5,19 @@ import os
 import pandas as pd
 from numpy import savetxt
 
+from BackgroundModel import BackgroundModel
+from FrameSource import FrameSource
+from StreamingNormalizer import StreamingNormalizer
+
 sample='K:\\ThermalLensing\\Data\\June14\\CarbonTet'
 
+# How the frames of the first 2 seconds are combined into the background, see BackgroundModel.MODELS
+background_model = 'mean'
+
+
+def has_empty_row(frame):
+    return np.any(np.all(frame == 0, axis=1))
+
 # Directory paths
 video_directory = sample  # Replace with your video directory
 timestamps_directory = sample  # Replace with your timestamps directory
@@ -25,12 +36,12 @@ for video_file in video_files:
     output_directory = os.path.join(video_directory, base_name, f'{base_name}{run}')
     os.makedirs(output_directory, exist_ok=True)
 
-    # Load the video
-    cap = cv2.VideoCapture(os.path.join(video_directory, video_file))
+    # Load the video as greyscale frames flipped vertically
+    source = FrameSource(os.path.join(video_directory, video_file), flip=True)
 
     # Get frame rate and frame size for video writer
-    frame_rate = cap.get(cv2.CAP_PROP_FPS)
-    frame_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    frame_rate = source.fps
+    frame_size = (source.width, source.height)
 
     # Define the codec and create VideoWriter objects
     fourcc = cv2.VideoWriter_fourcc(*'MJPG')
@@ -40,64 +51,55 @@ for video_file in video_files:
     # Load the timestamps
     timestamps = pd.read_csv(os.path.join(timestamps_directory, f'{base_name}Red_timestamps_run{run}.csv'))
 
-    # Frame counter and lists to store frames and valid timestamps
+    # Frame counter and lists to store valid timestamps and the background frames
     frame_counter = 0
-    frame_list = []
     valid_timestamps = []
+    background_frames = []
 
     # Read video frame by frame
-    while True:
-        ret, frame = cap.read()
-
-        # Break the loop if the frame cannot be read (end of video)
-        if not ret:
-            break
-
-        # Convert the frame to grayscale and flip vertically
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        frame = cv2.flip(frame, 0)
-
+    for frame in source:
         # Write the flipped frame to the new video
         out_flipped.write(frame)
 
         # Check if frame contains a row filled with zeros
-        if np.any(np.all(frame == 0, axis=1)):
+        if has_empty_row(frame):
             continue  # skip this frame
 
-        # Append the frame to the frame list and corresponding timestamp
-        frame_list.append(frame)
+        # Store the corresponding timestamp, and the frame if it has a timestamp less than 2 seconds
         valid_timestamps.append(timestamps.loc[frame_counter])
+        if valid_timestamps[-1]['timestamp'] < 2:
+            background_frames.append(frame)
 
         # Update frame counter
         frame_counter += 1
 
-    # Close the video file and the flipped video
-    cap.release()
+    # Close the flipped video
     out_flipped.release()
 
-    # Convert frame list into numpy array for easier manipulation
-    frame_array = np.array(frame_list)
-
     # Convert valid_timestamps into a DataFrame
     valid_timestamps = pd.DataFrame(valid_timestamps)
 
-    # Identify frames which have timestamps less than 2 seconds
-    frames_before_2s = frame_array[valid_timestamps['timestamp'] < 2]
-
-    # Average these frames
-    average_frame = np.mean(frames_before_2s, axis=0)
-
-    # Subtract the average frame from each frame and normalize
-    subtract_frame_array = np.abs(frame_array.astype(np.int32) - average_frame.astype(np.int32))
-    global_min_subtract = np.min(subtract_frame_array)
-    global_max_subtract = np.max(subtract_frame_array)
-    subtract_frame_array = ((subtract_frame_array - global_min_subtract) * (255 / (global_max_subtract - global_min_subtract))).astype(np.uint8)
-
-    # Create a list to store diff frames
-    diff_frame_list = []
+    # Average the frames before 2 seconds
+    background = BackgroundModel(len(background_frames), background_model)
+    for frame in background_frames:
+        background.update(frame)
+    average_frame = background.reference.astype(np.int32)
+    del background_frames
+
+    # Subtract the average frame from each frame, reading the video a second time instead of keeping
+    # all frames in memory; the differences are spilled to a scratch file until they can be normalized
+    subtract_normalizer = StreamingNormalizer()
+    for frame in source:
+        if not has_empty_row(frame):
+            subtract_normalizer.add(np.abs(frame.astype(np.int32) - average_frame))
+    source.close()
+
+    # The diff frames are normalized the same way
+    diff_normalizer = StreamingNormalizer()
+    previous_frame = None
 
     # Write the subtracted frames to the new video and generate marginal histograms
-    for i, subtract_frame in enumerate(subtract_frame_array):
+    for i, subtract_frame in enumerate(subtract_normalizer.frames()):
         out_subtracted.write(subtract_frame)
 
         # Generate and save row and column marginal histograms
@@ -119,27 +121,23 @@ for video_file in video_files:
             savetxt(os.path.join(output_directory, f'{prefix}marginal_{i}.csv'), mean_intensities)
 
         # Create the diff frames
-        if i > 0:  # Skip the first frame as it has no previous frame to subtract from
-            diff_frame = cv2.absdiff(subtract_frame_array[i-1], subtract_frame)
-            diff_frame_list.append(diff_frame)
+        if previous_frame is not None:  # Skip the first frame as it has no previous frame to subtract from
+            diff_normalizer.add(cv2.absdiff(previous_frame, subtract_frame))
+        previous_frame = subtract_frame
 
     # Close the subtracted video
     out_subtracted.release()
-
-    # Normalize diff frames
-    diff_frame_array = np.array(diff_frame_list)
-    global_min_diff = np.min(diff_frame_array)
-    global_max_diff = np.max(diff_frame_array)
-    diff_frame_array = ((diff_frame_array - global_min_diff) * (255 / (global_max_diff - global_min_diff))).astype(np.uint8)
+    subtract_normalizer.close()
 
     # Define the codec and create VideoWriter objects
     out_diff = cv2.VideoWriter(os.path.join(output_directory, f'{base_name}{run}_subtract_diff.avi'), fourcc, frame_rate, frame_size, isColor=False)
 
-    # Write diff frames to the new video
-    for diff_frame in diff_frame_array:
+    # Normalize and write diff frames to the new video
+    for diff_frame in diff_normalizer.frames():
         out_diff.write(diff_frame)
 
     # Close the diff video
     out_diff.release()
+    diff_normalizer.close()
 
     print(f"Processed {base_name} run {run}")
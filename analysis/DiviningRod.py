@@ -7,6 +7,8 @@ import cv2
 import numpy as np
 import csv
 
+from FrameSource import FrameSource
+
 class DiviningRod:
 
     def __init__(self, master):
@@ -106,10 +108,10 @@ class DiviningRod:
             base_name = os.path.splitext(os.path.basename(input_file))[0]
             wavefront_file = f"{folder_path}/{base_name}_wavefront.csv"
 
-            cap = cv2.VideoCapture(input_file)
-            frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            fps = cap.get(cv2.CAP_PROP_FPS)
+            source = FrameSource(input_file)
+            frame_width = source.width
+            frame_height = source.height
+            fps = source.fps
 
             fourcc = cv2.VideoWriter_fourcc(*'MJPG')
             out = cv2.VideoWriter(f'{folder_path}/{base_name}_wavefront.avi', fourcc, fps, (frame_width, frame_height))
@@ -122,12 +124,9 @@ class DiviningRod:
 
                 frame_number = 0
 
-                while True:
-                    ret, frame = cap.read()
-                    if not ret:
-                        break
-
-                    gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                for gray_frame in source:
+                    # The wavefront is drawn in colour onto the greyscale frame
+                    frame = cv2.cvtColor(gray_frame, cv2.COLOR_GRAY2BGR)
                     x_positions = []
                     y_positions = []
 
@@ -169,7 +168,7 @@ class DiviningRod:
                     out.write(frame)
                     frame_number += 1
 
-                cap.release()
+                source.close()
                 out.release()
 
         self.console.insert(tk.END, f"Wavefront analysis completed for all files in {folder_path}.\n")
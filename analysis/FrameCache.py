@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+from FrameSource import FrameSource
+
+# Decoded frame stacks are kept here, shared by all analysis scripts
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.thermallens_cache')
+
+# Room for the .npy header before the frames
+HEADER_LENGTH = 4096
+
+# Least recently used stacks are deleted when the cache grows beyond this
+DEFAULT_MAX_BYTES = 20 * 2 ** 30
+
+
+def write_header(f, dtype, shape):
+    # Version 1.0 .npy header, padded with spaces to HEADER_LENGTH bytes
+    header = repr({'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': shape})
+    header = header.ljust(HEADER_LENGTH - len(np.lib.format.MAGIC_PREFIX) - 4 - 1) + '\n'
+    f.write(np.lib.format.MAGIC_PREFIX + bytes([1, 0]) + struct.pack('<H', len(header)) + header.encode('latin1'))
+
+
+class FrameCache:
+    """
+    Keep decoded frame stacks on disk as .npy files, so a video is only decoded once.
+
+    The key of a stack is the absolute path, size and modification time of the source
+    file plus the transform applied while decoding it (channel, flip and crop), so a
+    changed video or a different transform is decoded again. Cached stacks are read
+    back through a memory map, which makes a second analysis of the same dataset skip
+    the video decode entirely and only read the frames and pixels it uses.
+
+    Every hit touches the stack, and when the cache grows beyond max_bytes the least
+    recently used stacks are deleted.
+
+        cache = FrameCache()
+        with cache.open('sampleRed_average_subtract.avi', roi=(0, 315, None, 1)) as source:
+            for frame in source:
+                ...
+
+    :param directory: directory of the cache
+    :param max_bytes: size limit of all cached stacks together
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, file_name, channel='grey', flip=False, crop=None):
+        stat = os.stat(file_name)
+        description = [os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns, channel, flip,
+                       list(crop) if crop is not None else None]
+        return hashlib.sha1(json.dumps(description).encode('utf-8')).hexdigest()
+
+    def open(self, file_name, channel='grey', flip=False, crop=None, **view):
+        """
+        Return a FrameSource of the decoded frames of file_name, decoding them first if they aren't cached.
+
+        :param channel: channel of the cached frames, as for FrameSource
+        :param flip: flip the cached frames vertically
+        :param crop: (x, y, width, height) cropped before caching, None to cache whole frames
+        :param view: roi, start and stop applied when reading the cached stack, as for FrameSource
+        """
+        key = self.key(file_name, channel, flip, crop)
+        stack_file = os.path.join(self.directory, key + '.npy')
+        info_file = os.path.join(self.directory, key + '.json')
+        if not (os.path.exists(stack_file) and os.path.exists(info_file)):
+            self._decode(file_name, stack_file, info_file, channel, flip, crop)
+            self.evict(keep=stack_file)
+        else:
+            os.utime(stack_file)  # Mark as recently used
+
+        with open(info_file) as f:
+            info = json.load(f)
+        source = FrameSource(stack_file, fps=info['fps'], **view)
+        if info['timestamps'] is not None:
+            source.timestamps = np.array(info['timestamps'])[source.start:source.stop]
+        return source
+
+    def _decode(self, file_name, stack_file, info_file, channel, flip, crop):
+        # Written under a temporary name, so an interrupted decode never looks like a cached stack
+        temporary_file = f"{stack_file}.{os.getpid()}.tmp"
+        with FrameSource(file_name, channel=channel, flip=flip, roi=crop) as source:
+            # The frame count of raw streams is only known at the end, so the frames are written after
+            # room for the .npy header, which is filled in once they have all been decoded
+            frame_count = 0
+            dtype = np.dtype(np.uint8)
+            frame_shape = (source.height, source.width)
+            with open(temporary_file, 'wb') as f:
+                f.seek(HEADER_LENGTH)
+                for batch in source.batches():
+                    f.write(batch.tobytes())
+                    frame_count += len(batch)
+                    dtype, frame_shape = batch.dtype, batch.shape[1:]
+                f.seek(0)
+                write_header(f, dtype, (frame_count,) + tuple(frame_shape))
+            fps = source.fps
+            timestamps = source.timestamps
+
+        with open(info_file, 'w') as f:
+            json.dump({
+                'source': os.path.abspath(file_name),
+                'channel': channel,
+                'flip': flip,
+                'crop': list(crop) if crop is not None else None,
+                'fps': fps,
+                'timestamps': timestamps.tolist() if timestamps is not None else None,
+            }, f)
+        os.replace(temporary_file, stack_file)
+
+    def evict(self, keep=None):
+        """Delete the least recently used stacks until the cache fits into max_bytes."""
+        stacks = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy'):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                stacks.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in stacks)
+        for _, size, path in sorted(stacks):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            os.remove(path)
+            info_file = path[:-len('.npy')] + '.json'
+            if os.path.exists(info_file):
+                os.remove(info_file)
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy') or name.endswith('.json'):
+                os.remove(os.path.join(self.directory, name))
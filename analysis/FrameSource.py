@@ -0,0 +1,185 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+
+# The raw container reader lives with the acquisition programs, one directory up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FrameSource:
+    """
+    Read the frames of a recording as greyscale or red channel arrays.
+
+    All analysis scripts read their videos through this class, so decoding, channel
+    extraction, flipping and cropping happen in one place. The backend is chosen from
+    the file extension:
+
+    - .tlraw: raw container of the uc480 acquisition program, read through a memory map
+    - .npy: frame stack of shape (frames, height, width) or (frames, height, width, 3), memory mapped
+    - anything else (.avi, .h264, ...): decoded with cv2.VideoCapture
+
+    The area of interest is cropped before the channel is extracted and the frame
+    flipped, so only the pixels that are used get converted. Memory mapped files only
+    read the cropped part of every frame from disk.
+
+        with FrameSource('sampleRed0.h264', channel='red', flip=True) as source:
+            for frame in source:
+                ...
+
+    :param file_name: video, .tlraw or .npy file
+    :param channel: 'grey' for BGR to greyscale conversion, 'red' for the red channel, 'bgr' for the frames as decoded
+    :param flip: flip the frames vertically, as cv2.flip(frame, 0)
+    :param roi: (x, y, width, height) of the area to keep, in the coordinates of the flipped frame, None for all;
+                a width or height of None extends to the edge of the frame
+    :param start: first frame to read
+    :param stop: frame to stop before, None to read to the end
+    :param fps: frame rate of .npy files, which don't store one
+    """
+
+    def __init__(self, file_name, channel='grey', flip=False, roi=None, start=0, stop=None, fps=None):
+        if channel not in ('grey', 'red', 'bgr'):
+            raise ValueError(f"Unknown channel {channel}")
+        self.file_name = file_name
+        self.channel = channel
+        self.flip = flip
+        self.fps = fps
+        self.timestamps = None
+        self._cap = None
+        self._frames = None
+        self._position = 0  # Next frame the video capture will decode
+
+        extension = os.path.splitext(file_name)[1].lower()
+        if extension == '.tlraw':
+            from RawFrameContainer import RawFrameReader
+            reader = RawFrameReader(file_name)
+            self._frames = reader.frames
+            self.fps = reader.fps
+            self.timestamps = reader.timestamps
+        elif extension == '.npy':
+            self._frames = np.load(file_name, mmap_mode='r')
+        else:
+            self._cap = cv2.VideoCapture(file_name)
+            if not self._cap.isOpened():
+                raise IOError(f"Could not open video {file_name}")
+            self.fps = self._cap.get(cv2.CAP_PROP_FPS)
+
+        if self._frames is not None:
+            total_frames = len(self._frames)
+            full_height, full_width = self._frames.shape[1:3]
+        else:
+            # Raw .h264 streams have no index, so their frame count is unknown
+            total_frames = int(self._cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            total_frames = total_frames if total_frames > 0 and extension != '.h264' else None
+            full_width = int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            full_height = int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        # The area of interest is given for the flipped frame, convert it to rows of the stored frame
+        x, y, width, height = roi if roi is not None else (0, 0, None, None)
+        x, y = max(0, x), max(0, y)
+        width = max(0, full_width - x if width is None else min(width, full_width - x))
+        height = max(0, full_height - y if height is None else min(height, full_height - y))
+        if flip:
+            self._rows = slice(full_height - y - height, full_height - y)
+        else:
+            self._rows = slice(y, y + height)
+        self._columns = slice(x, x + width)
+        self.width = width
+        self.height = height
+
+        self.total_frames = total_frames
+        self.start = start
+        self.stop = stop if total_frames is None else min(stop if stop is not None else total_frames, total_frames)
+        self.frame_count = None if self.stop is None else max(0, self.stop - start)
+        if self.timestamps is not None:
+            self.timestamps = self.timestamps[start:self.stop]
+
+    def __len__(self):
+        if self.frame_count is None:
+            raise TypeError(f"The frame count of {self.file_name} is unknown before it has been read")
+        return self.frame_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+    def _transform(self, frame):
+        frame = frame[self._rows, self._columns]
+        if frame.ndim == 3:
+            if self.channel == 'grey':
+                frame = cv2.cvtColor(np.ascontiguousarray(frame), cv2.COLOR_BGR2GRAY)
+            elif self.channel == 'red':
+                frame = frame[:, :, 2]
+        if self.flip:
+            frame = frame[::-1]
+        return np.ascontiguousarray(frame)
+
+    def __iter__(self):
+        if self._frames is not None:
+            for i in range(self.start, self.stop):
+                yield self._transform(self._frames[i])
+            return
+
+        self._seek(self.start)
+        while self.stop is None or self._position < self.stop:
+            ret, frame = self._cap.read()
+            if not ret:
+                break
+            self._position += 1
+            yield self._transform(frame)
+
+    def _seek(self, index):
+        if index == self._position:
+            return
+        if self.total_frames is not None:
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+        else:
+            # Without an index the stream can't seek, reopen it if needed and skip frames without converting them
+            if index < self._position:
+                self._cap.open(self.file_name)
+                self._position = 0
+            while self._position < index and self._cap.grab():
+                self._position += 1
+        self._position = index
+
+    def batches(self, batch_size=64):
+        """Yield the frames as arrays of shape (frames, height, width), batch_size frames at a time."""
+        if self._frames is not None:
+            for first in range(self.start, self.stop, batch_size):
+                batch = self._frames[first:min(first + batch_size, self.stop), self._rows, self._columns]
+                if batch.ndim == 4:
+                    if self.channel == 'grey':
+                        # cvtColor converts the whole stack at once when it is laid out as one tall image
+                        n, height, width, _ = batch.shape
+                        batch = cv2.cvtColor(np.ascontiguousarray(batch).reshape(n * height, width, 3),
+                                             cv2.COLOR_BGR2GRAY).reshape(n, height, width)
+                    elif self.channel == 'red':
+                        batch = batch[..., 2]
+                if self.flip:
+                    batch = batch[:, ::-1]
+                yield np.ascontiguousarray(batch)
+            return
+
+        batch = []
+        for frame in self:
+            batch.append(frame)
+            if len(batch) == batch_size:
+                yield np.stack(batch)
+                batch = []
+        if batch:
+            yield np.stack(batch)
+
+    def read_all(self):
+        """Return all frames as one array of shape (frames, height, width)."""
+        batches = list(self.batches())
+        if not batches:
+            return np.zeros((0, self.height, self.width), dtype=np.uint8)
+        return np.concatenate(batches)
@@ -4,13 +4,83 @@ from tkinter import filedialog
 import os
 import cv2
 import csv
+import queue
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from glob import glob
 import numpy as np
 import warnings
 
+from AnalysisManifest import AnalysisManifest
+from BackgroundModel import MODELS, subtract_background
+from FrameSource import FrameSource
+from SinglePass import single_pass, single_pass_outputs, single_pass_wavefront, wavefront_output
+from StreamingNormalizer import StreamingNormalizer, MODES as NORMALIZATION_MODES
+
 # Ignore RankWarning
 warnings.simplefilter('ignore', np.RankWarning)
 
+
+def conversion_outputs(input_file, directory):
+    # Flipped greyscale and subtracted video of a raw data file
+    base_name = os.path.splitext(os.path.basename(input_file))[0]
+    return f"{directory}/{base_name}_flipped.avi", f"{directory}/{base_name}_subtract.avi"
+
+
+def convert_video(input_file, directory, frame_num, background_model, normalization):
+    # Write the flipped red channel and background subtracted videos of one raw data file.
+    # Runs in the worker processes of the parallel conversion, so it only uses its arguments
+    # and returns the base name for the progress messages
+
+    # Parse the base file name
+    base_name = os.path.splitext(os.path.basename(input_file))[0]
+
+    # Construct the output file names
+    grey_file, subtract_file = conversion_outputs(input_file, directory)
+
+    # Open the video file, reading the red channel flipped vertically as greyscale frames
+    source = FrameSource(input_file, channel='red', flip=True)
+
+    # Get the frame size and frame rate
+    frame_size = (source.width, source.height)
+    frame_rate = source.fps
+
+    # Define the codec
+    fourcc = cv2.VideoWriter_fourcc(*'XVID')
+
+    # Create VideoWriter objects for the greyscale and subtracted videos
+    out_grey = cv2.VideoWriter(grey_file, fourcc, frame_rate, frame_size, isColor=False)
+
+    # The subtracted frames are normalised to the extremes of the whole video, which are
+    # only known at the end, without keeping the frames in memory
+    normalizer = StreamingNormalizer(normalization)
+
+    # Read video frame by frame
+    for frame_grey, subtract_frame in subtract_background(source, frame_num, background_model):
+        # Save the flipped greyscale frame
+        out_grey.write(frame_grey)
+        if subtract_frame is not None:
+            normalizer.add(subtract_frame)
+
+    # Create VideoWriter object for the subtracted video
+    out_subtract = cv2.VideoWriter(subtract_file, fourcc, frame_rate, frame_size, isColor=False)
+
+    # Normalize and write the subtracted frames
+    if normalization == 'spill':
+        for frame in normalizer.frames():
+            out_subtract.write(frame)
+    else:
+        for _, subtract_frame in subtract_background(source, frame_num, background_model):
+            if subtract_frame is not None:
+                out_subtract.write(normalizer.normalize(subtract_frame))
+
+    # Release everything when done
+    normalizer.close()
+    source.close()
+    out_grey.release()
+    out_subtract.release()
+    return base_name
+
 class App:
     def __init__(self, root):
         self.root = root
@@ -44,12 +114,33 @@ class App:
         self.frame_number_entry = ttk.Entry(self.tab1)
         self.frame_number_entry.grid(row=1, column=1, padx=5, pady=5)
         self.frame_number_entry.insert(0, "120")  # default value
+        self.background_model_label = ttk.Label(self.tab1, text="Background model: ")
+        self.background_model_label.grid(row=2, column=0, sticky='W', padx=25, pady=5)
+        self.background_model_var = tk.StringVar(value='mean')
+        self.background_model_menu = ttk.Combobox(self.tab1, textvariable=self.background_model_var,
+                                                  values=MODELS, state='readonly', width=17)
+        self.background_model_menu.grid(row=2, column=1, padx=5, pady=5)
+        # Spill keeps the subtracted frames in a scratch file, reread decodes the video a second time instead
+        self.normalization_label = ttk.Label(self.tab1, text="Normalisation: ")
+        self.normalization_label.grid(row=3, column=0, sticky='W', padx=25, pady=5)
+        self.normalization_var = tk.StringVar(value='spill')
+        self.normalization_menu = ttk.Combobox(self.tab1, textvariable=self.normalization_var,
+                                               values=NORMALIZATION_MODES, state='readonly', width=17)
+        self.normalization_menu.grid(row=3, column=1, padx=5, pady=5)
+        self.workers_label = ttk.Label(self.tab1, text="Workers: ")
+        self.workers_label.grid(row=4, column=0, sticky='W', padx=25, pady=5)
+        self.workers_entry = ttk.Entry(self.tab1)
+        self.workers_entry.grid(row=4, column=1, padx=5, pady=5)
+        self.workers_entry.insert(0, str(os.cpu_count() or 1))  # 1 converts the files one after another
+        self.single_pass_var = tk.BooleanVar(value=False)
+        self.single_pass_check = ttk.Checkbutton(self.tab1, text="Single pass", variable=self.single_pass_var)
+        self.single_pass_check.grid(row=4, column=2, padx=5, pady=5)
         self.convert_button = ttk.Button(self.tab1, text="Convert Videos", command=self.convert_videos)
-        self.convert_button.grid(row=2, column=0, columnspan=3, pady=5)
+        self.convert_button.grid(row=5, column=0, columnspan=3, pady=5)
         self.quit_button1 = ttk.Button(self.tab1, text="Quit", command=self.root.destroy)
-        self.quit_button1.grid(row=3, column=0, columnspan=3, pady=5)
+        self.quit_button1.grid(row=6, column=0, columnspan=3, pady=5)
         self.console1 = tk.Text(self.tab1, width=50, height=10)
-        self.console1.grid(row=4, column=0, columnspan=3, padx=25, pady=5)
+        self.console1.grid(row=7, column=0, columnspan=3, padx=25, pady=5)
 
         # Centroid Calculation Tab
         self.folder_label2 = ttk.Label(self.tab2, text="Processed Data Folder:")
@@ -428,106 +519,142 @@ class App:
         # Get the directory and frame number from the GUI inputs
         directory = self.folder_entry1.get()
         frame_num = int(self.frame_number_entry.get())
+        background_model = self.background_model_var.get()
+        normalization = self.normalization_var.get()
+        try:
+            workers = int(self.workers_entry.get())
+        except ValueError:
+            self.console1.insert(tk.END, "Workers should be an integer value.\n")
+            self.root.update_idletasks()
+            return
 
         # Video processing and subtraction operation
         self.console1.insert(tk.END, "Finding all raw data files...\n")
         self.root.update_idletasks()
 
-        # Use glob to get a list of all .h264 files in the directory
-        input_files = glob(f"{directory}/*.h264")
+        # Use glob to get a list of all .h264 files in the directory, sorted so the runs are always taken in the same order
+        input_files = sorted(glob(f"{directory}/*.h264"))
         self.console1.insert(tk.END, "Starting to process raw data files...\n")
         self.root.update_idletasks()
         self.console1.insert(tk.END, "This could take a long time...\n")
         self.root.update_idletasks()
 
-        # Process each file
+        # The single pass also writes the kinetics, wavefront and signal strength of every run while
+        # the raw video is decoded, with the threshold and columns of the Wavefront Calculation tab.
+        # The wavefront is a step of its own, so when only the threshold or columns change it is
+        # found again in the subtracted video and the raw video isn't decoded again
+        parameters = {'background_frames': frame_num, 'background_model': background_model}
+        wavefront_parameters = None
+        if self.single_pass_var.get():
+            try:
+                threshold = int(self.threshold_entry2.get())
+                col_min = int(self.column_min_entry2.get())
+                col_max = int(self.column_max_entry2.get())
+            except ValueError:
+                self.console1.insert(tk.END, "Threshold and column selection should be integer values.\n")
+                self.root.update_idletasks()
+                return
+            stage = 'single_pass'
+            wavefront_parameters = {'threshold': threshold, 'column_min': col_min, 'column_max': col_max}
+            convert = partial(single_pass, frame_num=frame_num, background_model=background_model,
+                              threshold=threshold, col_min=col_min, col_max=col_max)
+            find_wavefront = partial(single_pass_wavefront, threshold=threshold, col_min=col_min, col_max=col_max)
+            outputs = single_pass_outputs
+        else:
+            stage = 'convert'
+            convert = partial(convert_video, frame_num=frame_num, background_model=background_model,
+                              normalization=normalization)
+            outputs = conversion_outputs
+
+        def wavefront_step(input_file):
+            # Inputs, parameters and outputs of the wavefront step of a single pass
+            subtract_file = single_pass_outputs(input_file, directory)[1]
+            return [subtract_file], wavefront_parameters, [wavefront_output(input_file, directory)]
+
+        def record(input_file):
+            manifest.record(stage, [input_file], parameters, outputs(input_file, directory))
+            if wavefront_parameters is not None:
+                manifest.record('single_pass_wavefront', *wavefront_step(input_file))
+
+        # Files converted before with the same settings are skipped. The normalisation mode doesn't
+        # change the output, so switching it doesn't make the conversion stale
+        manifest = AnalysisManifest(directory)
+        tasks = {}
         for input_file in input_files:
-            # Parse the base file name
-            base_name = os.path.splitext(os.path.basename(input_file))[0]
-
-            # Construct the output file names
-            grey_file = f"{directory}/{base_name}_flipped.avi"
-            subtract_file = f"{directory}/{base_name}_subtract.avi"
-
-            # Open the video file
-            cap = cv2.VideoCapture(input_file)
-
-            # Get the frame size and frame rate
-            frame_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
-            frame_rate = cap.get(cv2.CAP_PROP_FPS)
-
-            # Define the codec
-            fourcc = cv2.VideoWriter_fourcc(*'XVID')
-
-            # Create VideoWriter objects for the greyscale and subtracted videos
-            out_grey = cv2.VideoWriter(grey_file, fourcc, frame_rate, frame_size, isColor=False)
+            if manifest.stale(stage, [input_file], parameters, outputs(input_file, directory)):
+                tasks[input_file] = convert
+            elif wavefront_parameters is not None and manifest.stale('single_pass_wavefront', *wavefront_step(input_file)):
+                tasks[input_file] = find_wavefront
+            else:
+                base_name = os.path.splitext(os.path.basename(input_file))[0]
+                self.console1.insert(tk.END, f"{base_name} is up to date...\n")
+                self.root.update_idletasks()
+        input_files = list(tasks)
+
+        if workers > 1 and len(input_files) > 1:
+            # Every file is converted in its own worker process. The Tk loop stays responsive and
+            # collects the finished files from the queue, the rest of the conversion waits for all of them
+            self.convert_button.config(state=tk.DISABLED)
+            progress = queue.Queue()
+            executor = ProcessPoolExecutor(max_workers=min(workers, len(input_files)))
+            for input_file in input_files:
+                future = executor.submit(tasks[input_file], input_file, directory)
+                future.add_done_callback(lambda future, input_file=input_file: progress.put((input_file, future)))
+            executor.shutdown(wait=False)
+            self.root.after(100, self.poll_conversion, progress, len(input_files), directory, manifest, record, [])
+            return
 
-            # Frame counter and list to store the first 120 frames
-            frame_counter = 0
-            first_frames = []
+        # Process each file
+        for input_file in input_files:
+            base_name = tasks[input_file](input_file, directory)
+            record(input_file)
+            self.console1.insert(tk.END, f"{base_name} processed...\n")
+            self.root.update_idletasks()
 
-            subtract_frames = []
-            global_min_subtract = np.inf
-            global_max_subtract = -np.inf
+        self.finish_conversion(directory, manifest)
 
-            # Read video frame by frame
-            while True:
-                ret, frame = cap.read()
+    def poll_conversion(self, progress, remaining, directory, manifest, record, failed):
+        # Report the files the worker processes have finished since the last poll
+        while True:
+            try:
+                input_file, future = progress.get_nowait()
+            except queue.Empty:
+                break
+            remaining -= 1
+            if future.exception() is not None:
+                base_name = os.path.splitext(os.path.basename(input_file))[0]
+                self.console1.insert(tk.END, f"{base_name} failed: {future.exception()}\n")
+                failed.append(input_file)
+            else:
+                record(input_file)
+                self.console1.insert(tk.END, f"{future.result()} processed...\n")
+            self.console1.see(tk.END)
+
+        if remaining > 0:
+            self.root.after(100, self.poll_conversion, progress, remaining, directory, manifest, record, failed)
+            return
 
-                # Break the loop if the frame cannot be read (end of video)
-                if not ret:
-                    break
-
-                # Convert the frame to grayscale using the red channel, flip vertically, and save
-                frame_grey = frame[:, :, 2]
-                frame_grey = cv2.flip(frame_grey, 0)
-                out_grey.write(frame_grey)
-
-                # If it's one of the first 120 frames, add it to the list
-                if frame_counter < 120:
-                    first_frames.append(frame_grey)
-                else:
-                    # Calculate the average of the first 120 frames
-                    average_frame = np.mean(first_frames, axis=0)
-
-                    # Subtract the average frame from the current frame
-                    subtract_frame = np.abs(frame_grey.astype(np.int32) - average_frame.astype(np.int32))
-                    min_val = np.min(subtract_frame)
-                    max_val = np.max(subtract_frame)
-                    if min_val < global_min_subtract:
-                        global_min_subtract = min_val
-                    if max_val > global_max_subtract:
-                        global_max_subtract = max_val
-
-                    subtract_frames.append(subtract_frame)
-
-                # Update frame counter
-                frame_counter += 1
-
-            # Create VideoWriter object for the subtracted video
-            out_subtract = cv2.VideoWriter(subtract_file, fourcc, frame_rate, frame_size, isColor=False)
-
-            # Normalize and write the subtracted frames
-            for frame in subtract_frames:
-                frame = ((frame - global_min_subtract) * (255 / (global_max_subtract - global_min_subtract))).astype(
-                    np.uint8)
-                out_subtract.write(frame)
-
-            # Release everything when done
-            cap.release()
-            out_grey.release()
-            out_subtract.release()
-            self.console1.insert(tk.END, f"{base_name} processed...\n")
-            self.root.update_idletasks()
+        self.convert_button.config(state=tk.NORMAL)
+        self.finish_conversion(directory, manifest, failed)
 
+    def finish_conversion(self, directory, manifest, failed=()):
         self.console1.insert(tk.END, "All raw data files processed.\n")
         self.root.update_idletasks()
 
+        # A sample with a run that failed to convert would be averaged and calibrated from a missing
+        # or an old subtracted video of that run, so it is left out until it converts
+        failed_samples = {os.path.basename(input_file).split('Red')[0] for input_file in failed}
+        for base_name in sorted(failed_samples):
+            self.console1.insert(tk.END, f"Skipping {base_name}, not all of its runs were converted\n")
+        self.root.update_idletasks()
+
         self.console1.insert(tk.END, "Averaging processed videos...\n")
         self.root.update_idletasks()
         # Video averaging
 
-        input_files = glob(f"{directory}/*Red*_subtract.avi")
+        # Without the averages of an earlier conversion, which match the pattern too
+        input_files = [f for f in sorted(glob(f"{directory}/*Red*_subtract.avi"))
+                       if not f.endswith('Red_average_subtract.avi')]
 
         # Group files by base name (without the run number)
         grouped_files = {}
@@ -539,6 +666,16 @@ class App:
 
         # Process each group of files
         for base_name, files in grouped_files.items():
+            if base_name in failed_samples:
+                continue
+
+            # Only averaged again when a run was converted again, added or removed
+            out_file = f"{directory}/{base_name}Red_average_subtract.avi"
+            if not manifest.stale('average', files, {}, [out_file]):
+                self.console1.insert(tk.END, f"{base_name} is up to date...\n")
+                self.root.update_idletasks()
+                continue
+
             self.console1.insert(tk.END, f"Processing {base_name}...\n")
             self.root.update_idletasks()
 
@@ -546,25 +683,16 @@ class App:
             sum_frames = []
 
             for file in files:
-                # Open the video file
-                cap = cv2.VideoCapture(file)
+                # Open the video file as greyscale frames
+                source = FrameSource(file)
 
                 # Get the frame size and frame rate
-                frame_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
-                frame_rate = cap.get(cv2.CAP_PROP_FPS)
+                frame_size = (source.width, source.height)
+                frame_rate = source.fps
 
                 # Read video frame by frame
                 frame_counter = 0
-                while True:
-                    ret, frame = cap.read()
-
-                    # Break the loop if the frame cannot be read (end of video)
-                    if not ret:
-                        break
-
-                    # Convert the frame to grayscale
-                    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
+                for frame in source:
                     # If we need to add a new frame to sum_frames, do so
                     if frame_counter >= len(sum_frames):
                         sum_frames.append(np.zeros((frame_size[1], frame_size[0]), dtype=np.float64))
@@ -580,14 +708,13 @@ class App:
                     sum_frames[frame_counter] += np.zeros((frame_size[1], frame_size[0]), dtype=np.float64)
                     frame_counter += 1
 
-                # Release the VideoCapture
-                cap.release()
+                # Release the video file
+                source.close()
 
             # Calculate the average frames
             avg_frames = [(frame / len(files)).astype(np.uint8) for frame in sum_frames]
 
             # Define the codec and create a VideoWriter object
-            out_file = f"{directory}/{base_name}Red_average_subtract.avi"
             fourcc = cv2.VideoWriter_fourcc(*'XVID')
             out = cv2.VideoWriter(out_file, fourcc, frame_rate, frame_size, isColor=False)
 
@@ -597,6 +724,7 @@ class App:
 
             # Release the VideoWriter
             out.release()
+            manifest.record('average', files, {}, [out_file])
 
             self.console1.insert(tk.END, f"{base_name} processed...\n")
             self.root.update_idletasks()
@@ -609,14 +737,27 @@ class App:
         self.console1.insert(tk.END, "Getting time information.\n")
         self.root.update_idletasks()
 
-        input_files = glob(f"{directory}/**/*Red*_flipped.avi", recursive=True)
+        input_files = sorted(glob(f"{directory}/**/*Red*_flipped.avi", recursive=True))
 
         for input_file in input_files:
             # Parse the base file name
             base_name = os.path.splitext(os.path.basename(input_file))[0]
+            if base_name.split('Red')[0] in failed_samples:
+                continue
 
-            # Construct the information file name
+            # Construct the information, timestamps, shutter and time calibration file names
             info_file = f"{directory}/{base_name.split('Red')[0]}Red_info.txt"
+            run = base_name.split('Red')[1].split('_')[0]
+            timestamps_file = f"{directory}/{base_name.split('Red')[0]}Red_timestamps_run{run}.csv"
+            shutter_file = f"{directory}/{base_name.split('Red')[0]}Red_shutter_run{run}.csv"
+            time_calibration_file = f"{directory}/{base_name}_timecal.csv"
+
+            # Skip runs whose video and experiment files didn't change since they were calibrated
+            inputs = [input_file, info_file] + [f for f in (timestamps_file, shutter_file) if os.path.exists(f)]
+            if not manifest.stale('timecal', inputs, {}, [time_calibration_file]):
+                self.console1.insert(tk.END, f"{base_name} is up to date\n")
+                self.console1.see(tk.END)  # scroll to the end
+                continue
 
             # Open the info file and get experiment parameters
             with open(info_file, 'r') as f:
@@ -624,28 +765,52 @@ class App:
                 background_time = float(lines[-3].split(": ")[1])
                 laser_on_time = float(lines[-2].split(": ")[1])
                 recovery_time = float(lines[-1].split(": ")[1])
+                # Written by the acquisition program once the shutter has been calibrated
+                shutter_latency = 0.0
+                for line in lines:
+                    if line.startswith('Shutter Latency: '):
+                        shutter_latency = float(line.split(": ")[1])
 
             # Calculate the total experiment time
             total_experiment_time = background_time + laser_on_time + recovery_time
 
             # Count the frames in the video
-            cap = cv2.VideoCapture(input_file)
-            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            cap.release()
+            with FrameSource(input_file) as source:
+                total_frames = source.total_frames
 
             # Calculate the time per frame
             time_per_frame = total_experiment_time / total_frames
 
-            # Prepare the time calibration csv file
-            time_calibration_file = f"{directory}/{base_name}_timecal.csv"
-
-
-            # Write frame and time data to the csv file
+            # Use the per-frame timestamps saved by the acquisition program when they exist
+            frame_times = None
+            if os.path.exists(timestamps_file):
+                with open(timestamps_file, 'r', newline='') as f:
+                    frame_times = [float(row['timestamp']) for row in csv.DictReader(f)]
+                if len(frame_times) < total_frames:
+                    self.console1.insert(tk.END, f"{timestamps_file} has fewer rows than frames, "
+                                                 f"assuming evenly spaced frames\n")
+                    frame_times = None
+
+            # The laser reaches the sample one shutter latency after the recorded laser on command
+            laser_on = background_time
+            if os.path.exists(shutter_file):
+                with open(shutter_file, 'r', newline='') as f:
+                    for row in csv.DictReader(f):
+                        if row['event'] == 'laser_on':
+                            laser_on = float(row['timestamp'])
+                            break
+            laser_on += shutter_latency
+
+            # Write frame and time data to the csv file, laser_time is the time since the laser reached the sample
             with open(time_calibration_file, 'w', newline='') as f:
                 writer = csv.writer(f)
-                writer.writerow(["frame", "time"])
+                writer.writerow(["frame", "time", "laser_time"])
                 for i in range(total_frames):
-                    writer.writerow([i, i * time_per_frame])
+                    if frame_times is not None:
+                        writer.writerow([i, frame_times[i], frame_times[i] - laser_on])
+                    else:
+                        writer.writerow([i, i * time_per_frame, i * time_per_frame - laser_on])
+            manifest.record('timecal', inputs, {}, [time_calibration_file])
 
             # Update console instead of printing
             self.console1.insert(tk.END, f"Done with {input_file}\n")
@@ -685,32 +850,42 @@ class App:
         self.console2.insert(tk.END, "Finding all processed data files...\n")
         self.root.update_idletasks()
 
-        # Use glob to get a list of all subtracted .avi files in the directory
-        input_files = glob(f"{directory}/*subtract*.avi")
+        # Use glob to get a list of all subtracted .avi files in the directory, without the wavefront videos made from them
+        input_files = [f for f in sorted(glob(f"{directory}/*subtract*.avi")) if not f.endswith('_wavefront.avi')]
         self.console2.insert(tk.END, "Starting to calculate wavefront...\n")
         self.root.update_idletasks()
         self.console2.insert(tk.END, "This can take a long time...\n")
         self.root.update_idletasks()
 
+        manifest = AnalysisManifest(directory)
+        parameters = {'threshold': threshold, 'column_min': col_min, 'column_max': col_max}
+
         # Process each file
         for input_file in input_files:
             # Parse the base file name
             base_name = os.path.splitext(os.path.basename(input_file))[0]
 
-            # Construct the centroid file name
+            # Construct the centroid file and video names
             centroid_file = f"{directory}/{base_name}_wavefront.csv"
+            wavefront_file = f"{directory}/{base_name}_wavefront.avi"
 
-            # Open the video file
-            cap = cv2.VideoCapture(input_file)
+            # Skip videos already analysed with the same threshold and columns
+            if not manifest.stale('wavefront', [input_file], parameters, [centroid_file, wavefront_file]):
+                self.console2.insert(tk.END, f"{base_name} is up to date\n")
+                self.console2.see(tk.END)  # scroll to the end
+                continue
+
+            # Open the video file as greyscale frames
+            source = FrameSource(input_file)
 
             # Get video dimensions for the output video
-            frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            fps = cap.get(cv2.CAP_PROP_FPS)
+            frame_width = source.width
+            frame_height = source.height
+            fps = source.fps
 
             # Prepare the output video file
             fourcc = cv2.VideoWriter_fourcc(*'MJPG')
-            out = cv2.VideoWriter(f'{directory}/{base_name}_wavefront.avi', fourcc, fps, (frame_width, frame_height))
+            out = cv2.VideoWriter(wavefront_file, fourcc, fps, (frame_width, frame_height))
 
             # Prepare the centroid csv file
             with open(centroid_file, 'w', newline='') as f:
@@ -718,16 +893,9 @@ class App:
                 writer.writerow(["frame", "pixel"])  # write the header
 
                 frame_number = 0
-                while True:
-                    # Read the frame
-                    ret, frame = cap.read()
-
-                    # Break the loop if the frame cannot be read (end of video)
-                    if not ret:
-                        break
-
-                    # Convert the frame to grayscale
-                    gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                for gray_frame in source:
+                    # The wavefront is drawn in colour onto the greyscale frame
+                    frame = cv2.cvtColor(gray_frame, cv2.COLOR_GRAY2BGR)
 
                     # Crop the frame to the selected column range
                     cropped_frame = gray_frame[:, col_min:col_max]
@@ -768,9 +936,10 @@ class App:
 
                     frame_number += 1
 
-            # Release the video capture and writer
-            cap.release()
+            # Release the video file and writer
+            source.close()
             out.release()
+            manifest.record('wavefront', [input_file], parameters, [centroid_file, wavefront_file])
 
             # Update console instead of printing
             self.console2.insert(tk.END, f"Done with {input_file}\n")
@@ -783,8 +952,10 @@ class App:
 
 # Insert centroid calculation code here
 
-root = tk.Tk()
-root.geometry("475x475")
-root.iconbitmap("Centroid42.ico")
-app = App(root)
-root.mainloop()
+# The worker processes of the parallel conversion import this module, they must not open the window
+if __name__ == "__main__":
+    root = tk.Tk()
+    root.geometry("475x475")
+    root.iconbitmap("Centroid42.ico")
+    app = App(root)
+    root.mainloop()
@@ -1,48 +1,27 @@
-import cv2
 import numpy as np
 import glob
 import csv
 import os
 
-def process_video_to_heatmap(video_path):
-    # Open the video file
-    cap = cv2.VideoCapture(video_path)
+from FrameCache import FrameCache
 
-    if not cap.isOpened():
+def process_video_to_heatmap(video_path):
+    # Open the decoded video, it is only decoded again if it has changed since the last analysis
+    try:
+        source = FrameCache().open(video_path, roi=(0, 315, None, 1))
+    except IOError:
         print(f"Error: Could not open video {video_path}.")
         return None
 
-    # Get the number of frames and frame dimensions
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-
-    # Check if row 315 is within the frame height
-    if frame_height <= 315:
-        print(f"Error: Row 315 is out of bounds for the video {video_path}.")
-        return None
-
-    # Initialize a matrix to hold the averaged data
-    heatmap_data = np.zeros((frame_height, frame_count))
-
-    for i in range(frame_count):
-        ret, frame = cap.read()
-        if not ret:
-            print(f"Can't receive frame {i} from video {video_path}. Exiting ...")
-            break
-
-        # Convert to grayscale
-        frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-        # Compute the average along the columns
-        avg_intensity = np.mean(frame_gray, axis=1)
-
-        # Store the average data
-        heatmap_data[:, i] = avg_intensity
+    with source:
+        # Check if row 315 is within the frame height
+        if source.height < 1:
+            print(f"Error: Row 315 is out of bounds for the video {video_path}.")
+            return None
 
-    cap.release()
+        # Average the selected rows of every frame
+        row_data = np.array([np.mean(frame) for frame in source])
 
-    # Extract the data for the specific row
-    row_data = heatmap_data[315, :]
     return row_data
 
 # Ask the user for the directory
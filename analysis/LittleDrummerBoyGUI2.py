@@ -1,11 +1,12 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
-import cv2
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
 import os
 
+from FrameCache import FrameCache
+
 class HeatmapGUI(tk.Tk):
     def __init__(self):
         super().__init__()
@@ -101,17 +102,13 @@ class HeatmapGUI(tk.Tk):
             self.process_video(file_path)
 
     def process_video(self, input_file):
-        cap = cv2.VideoCapture(input_file)
+        # Only the selected columns are read, from the decoded frames of a previous run if there are any
+        min_pixel, max_pixel = self.min_pixel.get(), self.max_pixel.get()
+        source = FrameCache().open(input_file, channel='red', flip=True, roi=(min_pixel, 0, max_pixel - min_pixel, None))
         self.averaged_columns = []
         self.points_to_mark = []
 
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            frame_grey = frame[:, :, 2]
-            frame_grey = cv2.flip(frame_grey, 0)
-            cropped_frame = frame_grey[:, self.min_pixel.get():self.max_pixel.get()]
+        for cropped_frame in source:
             averaged_column = np.mean(cropped_frame, axis=1)
             self.averaged_columns.append(averaged_column)
 
@@ -119,7 +116,7 @@ class HeatmapGUI(tk.Tk):
                 if i > self.index_threshold.get() and val > self.threshold.get():
                     self.points_to_mark.append((i, len(self.averaged_columns) - 1))
                     break
-        cap.release()
+        source.close()
         messagebox.showinfo("Info", "Video processed successfully!")
 
     def save_heatmap(self):
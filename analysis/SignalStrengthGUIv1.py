@@ -1,4 +1,3 @@
-import cv2
 import numpy as np
 import os
 import csv
@@ -9,6 +8,8 @@ from tkinter import filedialog, scrolledtext
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
 
+from FrameSource import FrameSource
+
 
 selected_files = []
 #processed_data = None
@@ -29,29 +30,24 @@ def process_videos():
 
     # Process all selected files
     for current_filename in selected_files:
-        cap = cv2.VideoCapture(current_filename)
+        # Only the selected columns of the frames up to the end of the lens are read
+        source = FrameSource(current_filename, channel='red', roi=(start_col, 0, end_col - start_col, None),
+                             stop=lensframestop + 1)
         background_frames = []
         signal_frames = []
 
-        for i in range(lensframestop+5):
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            # As OpenCV loads images in BGR, we'll get the red channel
-            red_channel = frame[:, :, 2]
-
+        for i, red_channel in enumerate(source):
             if i < int(background_entry.get()):
                 background_frames.append(red_channel)
             elif lensframestart <= i <= lensframestop:
                 signal_frames.append(red_channel)
 
-        cap.release()
+        source.close()
 
         # Average frames and sum over specified columns
         if background_frames:
             average_background = np.mean(background_frames, axis=0)
-            summed_background = np.sum(average_background[:, start_col:end_col], axis=1)
+            summed_background = np.sum(average_background, axis=1)
 
             if aggregated_background is None:
                 aggregated_background = summed_background
@@ -60,7 +56,7 @@ def process_videos():
 
         if signal_frames:
             average_signal = np.mean(signal_frames, axis=0)
-            summed_signal = np.sum(average_signal[:, start_col:end_col], axis=1)
+            summed_signal = np.sum(average_signal, axis=1)
 
             if aggregated_signal is None:
                 aggregated_signal = summed_signal
@@ -0,0 +1,163 @@
+import csv
+import os
+
+import cv2
+import numpy as np
+
+from BackgroundModel import subtract_background
+from FrameSource import FrameSource
+from StreamingNormalizer import StreamingNormalizer
+
+# Row of the subtracted frames whose mean makes up the kinetics trace, as in KineticsDumper
+KINETICS_ROW = 315
+
+# Columns summed and frames averaged for the signal strength, the defaults of SignalStrengthGUIv1
+SIGNAL_COLUMNS = (0, 719)
+LENS_FRAMES = (202, 209)
+
+
+def single_pass_outputs(input_file, directory):
+    # Flipped and subtracted videos, kinetics trace and signal strength of a raw data file, which only
+    # depend on the background parameters
+    base_name = os.path.splitext(os.path.basename(input_file))[0]
+    return (f"{directory}/{base_name}_flipped.avi", f"{directory}/{base_name}_subtract.avi",
+            f"{directory}/{base_name}_kinetics.csv", f"{directory}/{base_name}_signal.csv")
+
+
+def wavefront_output(input_file, directory):
+    # Wavefront of a raw data file, which also depends on the threshold and columns
+    base_name = os.path.splitext(os.path.basename(input_file))[0]
+    return f"{directory}/{base_name}_wavefront.csv"
+
+
+def wavefront_position(frame, threshold, col_min, col_max):
+    # First pixel above the threshold in each column coming down from the top, averaged over the columns
+    # and measured from the bottom of the frame, as calculate_centroids of FullAnalysisGUIv3 does it
+    above = frame[:, col_min:col_max] > threshold
+    found = np.any(above, axis=0)
+    if not np.any(found):
+        return None
+    return frame.shape[0] - np.mean(np.argmax(above, axis=0)[found])
+
+
+def single_pass(input_file, directory, frame_num=120, background_model='mean', threshold=50, col_min=0, col_max=720,
+                kinetics_row=KINETICS_ROW, signal_columns=SIGNAL_COLUMNS, lens_frames=LENS_FRAMES):
+    """
+    Decode a raw data file once and write everything the analysis takes from it.
+
+    The chained analysis decodes the raw video, writes the flipped and subtracted videos,
+    and every later step decodes those XVID videos again, each time with the compression
+    losses. Here the raw video is decoded a single time, and
+
+    - the flipped red channel and background subtracted videos are written as by convert_video of FullAnalysisGUIv3
+    - the mean of kinetics_row of every subtracted frame goes to _kinetics.csv, the trace KineticsDumper takes
+      from the averaged video
+    - the wavefront of every subtracted frame goes to _wavefront.csv, found as in calculate_centroids
+    - the rows of the background and lens frames, summed over signal_columns, go to _signal.csv, the profiles
+      SignalStrengthGUIv1 divides, with the rows numbered as in the raw video
+
+    The kinetics and wavefront are taken from the normalised subtracted frames before they
+    are compressed, so they differ slightly from the values found in the subtracted videos.
+
+    :param frame_num: number of frames that make up the background
+    :param background_model: one of BackgroundModel.MODELS
+    :param threshold: intensity above which a pixel belongs to the wavefront
+    :param col_min: first column searched for the wavefront
+    :param col_max: column to stop the wavefront search before
+    :param kinetics_row: row of the subtracted frames averaged for the kinetics trace
+    :param signal_columns: (first, stop) columns summed for the signal strength
+    :param lens_frames: (first, last) frames averaged for the signal, the last one included
+    :return: base name of the file, for progress messages
+    """
+    base_name = os.path.splitext(os.path.basename(input_file))[0]
+    grey_file, subtract_file, kinetics_file, signal_file = single_pass_outputs(input_file, directory)
+    wavefront_file = wavefront_output(input_file, directory)
+
+    source = FrameSource(input_file, channel='red', flip=True)
+    frame_size = (source.width, source.height)
+    fourcc = cv2.VideoWriter_fourcc(*'XVID')
+    out_grey = cv2.VideoWriter(grey_file, fourcc, source.fps, frame_size, isColor=False)
+
+    # The subtracted frames are spilled until the extremes for the normalisation are known,
+    # so they are read back from the scratch file instead of being decoded a second time
+    normalizer = StreamingNormalizer('spill')
+
+    # Row profiles of the background and lens frames, summed as the frames come
+    background_profile = np.zeros(source.height, dtype=np.float64)
+    signal_profile = np.zeros(source.height, dtype=np.float64)
+    background_count = 0
+    signal_count = 0
+
+    for i, (frame_grey, subtract_frame) in enumerate(subtract_background(source, frame_num, background_model)):
+        out_grey.write(frame_grey)
+        if subtract_frame is not None:
+            normalizer.add(subtract_frame)
+
+        if i < frame_num:
+            background_profile += np.sum(frame_grey[:, signal_columns[0]:signal_columns[1]], axis=1)
+            background_count += 1
+        elif lens_frames[0] <= i <= lens_frames[1]:
+            signal_profile += np.sum(frame_grey[:, signal_columns[0]:signal_columns[1]], axis=1)
+            signal_count += 1
+
+    source.close()
+    out_grey.release()
+
+    # Write the subtracted video and measure its frames on the way
+    out_subtract = cv2.VideoWriter(subtract_file, fourcc, source.fps, frame_size, isColor=False)
+    with open(kinetics_file, 'w', newline='') as kinetics, open(wavefront_file, 'w', newline='') as wavefront:
+        kinetics_writer = csv.writer(kinetics)
+        kinetics_writer.writerow(['frame', 'mean'])
+        wavefront_writer = csv.writer(wavefront)
+        wavefront_writer.writerow(['frame', 'pixel'])
+
+        for frame_number, frame in enumerate(normalizer.frames()):
+            out_subtract.write(frame)
+            if kinetics_row < frame.shape[0]:
+                kinetics_writer.writerow([frame_number, np.mean(frame[kinetics_row])])
+            position = wavefront_position(frame, threshold, col_min, col_max)
+            if position is not None:
+                wavefront_writer.writerow([frame_number, position])
+
+    out_subtract.release()
+    normalizer.close()
+
+    # Mean profiles, flipped back to the rows of the raw video
+    background_profile = background_profile[::-1] / max(background_count, 1)
+    signal_profile = signal_profile[::-1] / max(signal_count, 1)
+    ratio = np.divide(signal_profile, background_profile, out=np.zeros_like(signal_profile),
+                      where=background_profile != 0)
+    with open(signal_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['row', 'background', 'signal', 'ratio'])
+        for row in range(len(ratio)):
+            writer.writerow([row, background_profile[row], signal_profile[row], ratio[row]])
+
+    return base_name
+
+
+def single_pass_wavefront(input_file, directory, threshold=50, col_min=0, col_max=720):
+    """
+    Find the wavefront of a raw data file again in the subtracted video of its single pass.
+
+    When only the threshold or columns changed, the raw video needn't be decoded again.
+    The frames are read back from the compressed subtracted video, so the positions
+    differ slightly from those single_pass finds before compression.
+
+    :param threshold: intensity above which a pixel belongs to the wavefront
+    :param col_min: first column searched for the wavefront
+    :param col_max: column to stop the wavefront search before
+    :return: base name of the file, for progress messages
+    """
+    base_name = os.path.splitext(os.path.basename(input_file))[0]
+    subtract_file = single_pass_outputs(input_file, directory)[1]
+
+    with FrameSource(subtract_file) as source, open(wavefront_output(input_file, directory), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['frame', 'pixel'])
+        for frame_number, frame in enumerate(source):
+            position = wavefront_position(frame, threshold, col_min, col_max)
+            if position is not None:
+                writer.writerow([frame_number, position])
+
+    return base_name
@@ -0,0 +1,87 @@
+import os
+import tempfile
+
+import numpy as np
+
+MODES = ('spill', 'reread')
+
+
+class StreamingNormalizer:
+    """
+    Normalise a stream of frames to 0-255 with the global minimum and maximum, in bounded memory.
+
+    Normalising needs the extremes of the whole video before the first frame can be
+    written, so the frames used to be kept in memory until the end of the file. Here
+    add() only updates the running minimum and maximum, and the frames are either
+
+    - spill: kept as compact uint16 values in a memory mapped scratch file, and read back by frames()
+    - reread: not kept at all; the caller produces them a second time and normalises each with normalize()
+
+    so the memory needed doesn't depend on the length of the video. Frames must hold
+    integers from 0 to 65535, e.g. absolute differences of uint8 or uint16 frames.
+
+        normalizer = StreamingNormalizer()
+        for frame in subtracted_frames:
+            normalizer.add(frame)
+        for frame in normalizer.frames():
+            out.write(frame)
+        normalizer.close()
+
+    :param mode: one of MODES
+    :param scratch_directory: directory of the scratch file, by default the system's temporary directory
+    """
+
+    def __init__(self, mode='spill', scratch_directory=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown normalisation mode {mode}")
+        self.mode = mode
+        self.scratch_directory = scratch_directory
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self.frame_count = 0
+        self.frame_shape = None
+        self._scratch = None
+        self._scratch_file = None
+
+    def add(self, frame):
+        self.minimum = min(self.minimum, np.min(frame))
+        self.maximum = max(self.maximum, np.max(frame))
+        self.frame_count += 1
+        self.frame_shape = frame.shape
+        if self.mode == 'spill':
+            if self._scratch is None:
+                handle, self._scratch_file = tempfile.mkstemp(suffix='.u16', dir=self.scratch_directory)
+                self._scratch = os.fdopen(handle, 'wb')
+            self._scratch.write(frame.astype(np.uint16).tobytes())
+
+    def normalize(self, frame):
+        # Same scaling as before, a constant video becomes black instead of dividing by zero
+        span = self.maximum - self.minimum
+        scale = 255 / span if span > 0 else 0
+        return ((frame - self.minimum) * scale).astype(np.uint8)
+
+    def frames(self):
+        """Yield the normalised frames that were added, in spill mode."""
+        if self.mode != 'spill':
+            raise ValueError("Only spilled frames can be read back, normalise the re-read frames instead")
+        if self._scratch is None:
+            return
+        self._scratch.flush()
+        spilled = np.memmap(self._scratch_file, dtype=np.uint16, mode='r',
+                            shape=(self.frame_count,) + self.frame_shape)
+        for frame in spilled:
+            yield self.normalize(frame.astype(np.int32))
+        del spilled
+
+    def close(self):
+        if self._scratch is not None:
+            self._scratch.close()
+            os.remove(self._scratch_file)
+            self._scratch = None
+            self._scratch_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
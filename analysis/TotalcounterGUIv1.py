@@ -1,44 +1,43 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, scrolledtext
 import threading
-import cv2
 import numpy as np
 import glob
 import os
 import csv
 import re
 
+from BackgroundModel import BackgroundModel
+from FrameSource import FrameSource
+
 # Video processing functions
-def process_video(video_path):
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
+def process_video(video_path, background_frames=100, background_model='mean'):
+    try:
+        source = FrameSource(video_path, channel='red', stop=background_frames)  # Using the red channel
+    except IOError:
         print("Error: Could not open video.")
         return None
 
-    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    avg_frame = np.zeros((frame_height, frame_width), np.float32)
+    frame_width = source.width
+    frame_height = source.height
 
-    for i in range(100):
-        ret, frame = cap.read()
-        if not ret:
-            break
-        avg_frame += frame[:, :, 2] / 100  # Using the red channel
+    with source:
+        background = BackgroundModel(background_frames, background_model)
+        for frame in source:
+            background.update(frame)
+    if not background.ready:
+        print("Error: Not enough frames for the background.")
+        return None
+    avg_frame = background.reference
 
-    cap.set(cv2.CAP_PROP_POS_FRAMES, 300)
     total_sum_of_squares = 0
 
-    for i in range(100):
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        diff_frame = frame[:, :,2] - avg_frame
-        diff_frame[np.abs(diff_frame) < 20] = 0
-        sum_of_squares = np.sum(np.square(diff_frame))
-        total_sum_of_squares += sum_of_squares
-
-    cap.release()
+    with FrameSource(video_path, channel='red', start=300, stop=400) as source:
+        for frame in source:
+            diff_frame = frame - avg_frame
+            diff_frame[np.abs(diff_frame) < 20] = 0
+            sum_of_squares = np.sum(np.square(diff_frame))
+            total_sum_of_squares += sum_of_squares
 
     # Calculate the mean of the squared differences for each frame
     num_pixels = frame_width * frame_height
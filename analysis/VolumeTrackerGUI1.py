@@ -5,6 +5,9 @@ import numpy as np
 import pandas as pd
 import os
 
+from BackgroundModel import BackgroundModel
+from FrameSource import FrameSource
+
 class HeatmapGUI(tk.Tk):
     def __init__(self):
         super().__init__()
@@ -57,50 +60,35 @@ class HeatmapGUI(tk.Tk):
         process_video(self.input_file, output_file, csv_file, threshold)
         messagebox.showinfo("Info", f"Files saved as {output_file} and {csv_file}")
 
-def process_video(input_file, output_file, csv_file, threshold=40, num_frames_to_average=120, min_area=100):
-    cap = cv2.VideoCapture(input_file)
-
-    # Check if video opened successfully
-    if not cap.isOpened():
+def process_video(input_file, output_file, csv_file, threshold=40, num_frames_to_average=120, min_area=100,
+                  background_model='mean'):
+    try:
+        source = FrameSource(input_file, channel='red', flip=True)
+    except IOError:
         messagebox.showerror("Error", "Could not open video file.")
         return
 
-    frame_sum = None
-    frame_count = 0
     target_pixel = None
     area_data = []
 
-    # Read and accumulate the first 120 frames
-    while frame_count < num_frames_to_average:
-        ret, frame = cap.read()
-        if not ret:
-            messagebox.showerror("Error", "Could not read frame.")
-            return
-        frame_grey = frame[:, :, 2]
-        frame_grey = cv2.flip(frame_grey, 0)
-        if frame_sum is None:
-            frame_sum = np.zeros_like(frame_grey, dtype=np.float64)
-        frame_sum += frame_grey
-        frame_count += 1
-
-    # Calculate the average frame
-    avg_frame = (frame_sum / frame_count).astype(np.float64)
-
-    # Reset the video capture to the beginning
-    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    # Build the background from the first frames
+    background = BackgroundModel(num_frames_to_average, background_model)
+    for frame_grey in source:
+        background.update(frame_grey)
+        if background.ready:
+            break
+    if not background.ready:
+        messagebox.showerror("Error", "Could not read frame.")
+        return
+    avg_frame = background.reference
 
     # Define the codec and create a VideoWriter object
     fourcc = cv2.VideoWriter_fourcc(*'XVID')
-    out = cv2.VideoWriter(output_file, fourcc, 20.0, (frame_grey.shape[1], frame_grey.shape[0]), isColor=False)
+    out = cv2.VideoWriter(output_file, fourcc, 20.0, (source.width, source.height), isColor=False)
 
+    # Read the video again from the beginning
     frame_count = 0
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        frame_grey = frame[:, :, 2]
-        frame_grey = cv2.flip(frame_grey, 0)
-
+    for frame_grey in source:
         # Subtract the average frame
         diff_frame = frame_grey.astype(np.float64) - avg_frame
 
@@ -155,7 +143,7 @@ def process_video(input_file, output_file, csv_file, threshold=40, num_frames_to
         frame_count += 1
 
     # Release everything when done
-    cap.release()
+    source.close()
     out.release()
 
     # Save the frame and area data to a CSV file
@@ -1,49 +1,31 @@
-import cv2
 import numpy as np
 import glob
 import csv
 import os
+import sys
 
-def process_video_to_heatmap(video_path):
-    # Open the video file
-    cap = cv2.VideoCapture(video_path)
+# FrameCache lives with the analysis scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'analysis'))
+from FrameCache import FrameCache
 
-    if not cap.isOpened():
+def process_video_to_heatmap(video_path):
+    # Open the decoded video, it is only decoded again if it has changed since the last analysis
+    try:
+        source = FrameCache().open(video_path, roi=(0, 305, None, 11))
+    except IOError:
         print(f"Error: Could not open video {video_path}.")
         return None
 
-    # Get the number of frames and frame dimensions
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-
-    # Check if row 315 is within the frame height
-    if frame_height <= 310:
-        print(f"Error: Row 310 is out of bounds for the video {video_path}.")
-        return None
-
-    # Initialize a matrix to hold the averaged data
-    heatmap_data = np.zeros((frame_height, frame_count))
-
-    for i in range(frame_count):
-        ret, frame = cap.read()
-        if not ret:
-            print(f"Can't receive frame {i} from video {video_path}. Exiting ...")
-            break
-
-        # Convert to grayscale
-        frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-        # Compute the average along the columns
-        avg_intensity = np.mean(frame_gray, axis=1)
-
-        # Store the average data
-        heatmap_data[:, i] = avg_intensity
+    with source:
+        # Check if rows 305 to 315 are within the frame height
+        if source.height < 11:
+            print(f"Error: Rows 305 to 315 are out of bounds for the video {video_path}.")
+            return None
 
-    cap.release()
+        # Average the selected rows of every frame
+        row_data = np.array([np.mean(frame) for frame in source])
 
-    rows_data = heatmap_data[305:316, :]  # Slices rows 305 to 315 (Python slicing excludes the upper bound)
-    row_data_avg = np.mean(rows_data, axis=0)  # Compute the average across the selected rows for each column/frame
-    return row_data_avg
+    return row_data
 
 # Ask the user for the directory
 directory = input("Enter the directory path: ")